@@ -18,19 +18,22 @@ bl_info = {
 # GOOD TUT: https://blender.stackexchange.com/questions/57306/how-to-create-a-custom-ui
 
 import bpy
-import importlib, sys
+import importlib, sys, os
+import subprocess
+import json
+import contextlib
 from bpy.props import IntProperty, EnumProperty, FloatProperty, BoolProperty, StringProperty, PointerProperty
 from bpy.types import PropertyGroup, Operator, Panel, Scene
 from bpy.app import driver_namespace
-from bpy.app.handlers import frame_change_pre, frame_change_post, depsgraph_update_post
+from bpy.app.handlers import frame_change_pre, frame_change_post, depsgraph_update_post, load_post, persistent
 import bmesh
 import mathutils
 from mathutils import Vector, geometry, Matrix
-from bpy_extras.object_utils import world_to_camera_view
 from math import radians
 import time
 import random
 from random import sample
+import numpy as np
 
 global ray_dist # raycast distance
 global cast_sens # raycast sensitivity, allows for offset of source vertex
@@ -50,6 +53,11 @@ class VampProperties(PropertyGroup):
         default = False,
         description = "Individual object silhouettes"
     )
+    vamp_sil_contour: BoolProperty(
+        name = "Contour",
+        default = False,
+        description = "Find silhouette from face normals (edges between front & back facing faces, and open edges) instead of extra raycasts"
+    )
     vamp_marked_mode: BoolProperty(
         name = "Freestyle",
         default = False,
@@ -93,6 +101,11 @@ class VampProperties(PropertyGroup):
         description = "Cull distance.",
         default = 10
     )
+    vamp_frustum_cull: BoolProperty(
+        name = "Frustum Cull",
+        default = True,
+        description = "Test object bounding boxes against camera view & cull radius before evaluating them"
+    )
     vamp_crop_options = [
         ("None","None","No cropping (fastest)",2),
         ("Front","Front","Forward facing only",1),
@@ -134,6 +147,19 @@ class VampProperties(PropertyGroup):
         description = "Edge Count Limit.",
         default = 100000
     )
+    vamp_deadline: FloatProperty(
+        name = "Deadline",
+        min = 0.0,
+        soft_max = 10.0,
+        default = 0.0,
+        precision = 2,
+        description = "Seconds per frame. If set, heavy frames are simplified to fit, instead of stopping at Edge Limit. 0 = off"
+    )
+    vamp_background: BoolProperty(
+        name = "Background",
+        default = False,
+        description = "Run VAMP a little at a time between screen updates, so Blender stays responsive. During playback only the newest frame is processed"
+    )
     vamp_subd_limit: IntProperty(
         name = "Cuts per Edge",
         soft_min = 2,
@@ -150,6 +176,129 @@ class VampProperties(PropertyGroup):
         default = 0.005,
         precision = 3
     )
+    vamp_subd_screen: BoolProperty(
+        name = "Screen Space",
+        default = False,
+        description = "Subdivide edges by their length on screen, instead of their length in the scene"
+    )
+    vamp_subd_pixels: FloatProperty(
+        name = "Pixels",
+        min = 0.5,
+        soft_max = 100.0,
+        default = 8.0,
+        precision = 1,
+        description = "Screen Space: target length of each subedge, in pixels of render resolution"
+    )
+    vamp_eval_cache: BoolProperty(
+        name = "Reuse Meshes",
+        default = True,
+        description = "Reuse evaluated meshes of unchanged objects between frames"
+    )
+    vamp_incremental: BoolProperty(
+        name = "Incremental",
+        default = False,
+        description = "Batch engine: when camera is static, only re-test edges near objects that moved"
+    )
+    vamp_bvh_cache: BoolProperty(
+        name = "Cache BVH",
+        default = False,
+        description = "Keep a hit test tree per object, only rebuilt when its shape changes"
+    )
+    vamp_cache_path: StringProperty(
+        name = "Cache File",
+        default = "//vamp_cache.vlc",
+        subtype = 'FILE_PATH',
+        description = "Line cache file, written by Bake Frames"
+    )
+    vamp_stats_log: BoolProperty(
+        name = "Log Stats",
+        default = False,
+        description = "Append each frame's timings & counts to stats file, as one JSON line per frame"
+    )
+    vamp_stats_path: StringProperty(
+        name = "Stats File",
+        default = "//vamp_stats.jsonl",
+        subtype = 'FILE_PATH',
+        description = "Stats log file, see Log Stats"
+    )
+    vamp_playback: BoolProperty(
+        name = "Playback",
+        default = False,
+        description = "On frame change, load baked frame from cache file instead of running VAMP"
+    )
+    vamp_workers: IntProperty(
+        name = "Workers",
+        min = 1,
+        soft_max = 64,
+        default = 4,
+        description = "Number of background Blender processes for Farm Bake"
+    )
+    vamp_export_options = [
+        ("None","None","No export",0),
+        ("Binary","Binary","Float32 segment arrays (compact, fastest)",1),
+        ("SVG","SVG","One SVG file per frame",2),
+        ("OBJ","OBJ","One OBJ file per frame, edges only",3)
+    ]
+    vamp_export_enum: EnumProperty(
+        items = vamp_export_options,
+        name = "Export",
+        default = "None"
+    )
+    vamp_export_path: StringProperty(
+        name = "Export Path",
+        default = "//vamp_export/frame_",
+        subtype = 'FILE_PATH',
+        description = "Folder & file name prefix for exported flat lines. Frame number is added"
+    )
+    vamp_export_index: BoolProperty(
+        name = "Index",
+        default = False,
+        description = "Binary export: append frames to one indexed stream file, instead of one file per frame"
+    )
+    vamp_adaptive: BoolProperty(
+        name = "Adaptive",
+        default = False,
+        description = "Batch engine: skip rays for edges with a clear view of camera, and pin down where visibility changes"
+    )
+    vamp_adaptive_tol: FloatProperty(
+        name = "Tolerance",
+        min = 0.00001,
+        soft_max = 0.1,
+        default = 0.001,
+        precision = 4,
+        description = "Adaptive: how closely to find where an edge becomes visible or hidden"
+    )
+    vamp_engine_options = [
+        ("Loop","Loop","Original per-edge loop",0),
+        ("Batch","Batch","Vectorized batch visibility (faster)",1),
+        ("Depth","Depth","Batch, with visibility from a depth buffer instead of raycasts",2)
+    ]
+    vamp_engine_enum: EnumProperty(
+        items = vamp_engine_options,
+        name = "Engine",
+        default = "Loop"
+    )
+    vamp_depth_res: IntProperty(
+        name = "Depth Res",
+        min = 64,
+        soft_max = 4096,
+        max = 16384,
+        default = 1024,
+        description = "Depth engine: width of depth buffer, in pixels"
+    )
+    vamp_depth_tol: FloatProperty(
+        name = "Depth Tol",
+        min = 0.0,
+        soft_max = 0.1,
+        default = 0.01,
+        precision = 3,
+        description = "Depth engine: how far an occluder must be in front of a point to hide it, as fraction of distance from camera"
+    )
+    vamp_depth_compare: BoolProperty(
+        name = "Compare",
+        default = False,
+        description = "Depth engine: also raycast every point, and report how often the two disagree (slow)"
+    )
     
     # new 7/24/20 trace mode options
     vamp_trace: BoolProperty(
@@ -163,6 +312,15 @@ class VampProperties(PropertyGroup):
         description = "Trace Vert Limit.",
         default = 10000
     )
+    vamp_trace_opt_time: FloatProperty(
+        name = "Optimize",
+        min = 0.0,
+        soft_max = 5.0,
+        default = 0.0,
+        precision = 2,
+        unit = 'TIME_ABSOLUTE',
+        description = "Seconds per trace to spend shortening the trace path (0 = off)"
+    )
     vamp_trace_options = [
         ("Verts","Verts","Use All Verts",0),
         ("Edges","Edges","Trace Edge Centers",1),
@@ -190,7 +348,72 @@ class VampProperties(PropertyGroup):
 vamp_on = False #switched off at beginning
 trace_on = False # trace defaults to off
 collapse_angle = 1.5 # radians, for dissolve function.
+weld_dist = 0.01 # sub-edge points closer than this are joined, like bmesh remove_doubles
 recent_frame = -1 # initialize recent frame
+last_result = None # arrays from most recent main_routine, see main_routine
+frame_view = None # camera_view() of current frame, shared by every projection in main_routine
+occluder_objs = [] # objects kept only for hit testing, not as edge sources. see frustum_cull
+baking = False # True while bake_frames is stepping through frames, so handler stays out of the way
+frame_stats = None # timings & counts of frame being processed, see begin_profile
+last_stats = None # frame_stats of most recent finished frame, shown in panel
+profile_stack = [] # time spent in nested stages, so each stage only counts its own time
+profile_paused = 0.0 # time spent waiting between Background job steps, left out of stats
+vamp_job = None # Background mode job in progress, see start_vamp_job
+job_slice = 0.05 # Background mode: seconds of work per timer call, before the UI gets a turn
+job_chunk_edges = 2000 # Background mode: batch engine edges tested between progress updates
+
+def profile_clock():
+    # perf_counter, minus time a Background job spent waiting for its next turn
+    return time.perf_counter() - profile_paused
+
+def begin_profile(frame):
+    global frame_stats
+    global profile_stack
+    frame_stats = {'frame': frame, 'start': profile_clock(), 'stages': {}, 'counts': {}}
+    profile_stack = []
+
+@contextlib.contextmanager
+def profile_stage(name):
+    # adds wall time of the with block to frame_stats stage. Time spent in nested stages is left out.
+    start = profile_clock()
+    profile_stack.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = profile_clock() - start
+        nested = profile_stack.pop()
+        if profile_stack:
+            profile_stack[-1] += elapsed
+        if frame_stats is not None:
+            stages = frame_stats['stages']
+            stages[name] = stages.get(name, 0.0) + elapsed - nested
+
+def count_stat(name, n=1):
+    if frame_stats is not None:
+        counts = frame_stats['counts']
+        counts[name] = counts.get(name, 0) + n
+
+def end_profile():
+    # finish frame_stats, keep for panel, and append to stats log if turned on
+    global frame_stats
+    global last_stats
+    if frame_stats is None:
+        return
+    vampparams = bpy.context.scene.vamp_params
+    stats = {'frame': frame_stats['frame'], 'time': time.time(), 'engine': vampparams.vamp_engine_enum,
+        'total': profile_clock() - frame_stats['start'], 
+        'stages': {name: round(t, 6) for name, t in frame_stats['stages'].items()},
+        'counts': frame_stats['counts']}
+    if 'memory' in frame_stats:
+        stats['memory'] = frame_stats['memory']
+    frame_stats = None
+    last_stats = stats
+    if vampparams.vamp_stats_log:
+        try:
+            with open(bpy.path.abspath(vampparams.vamp_stats_path), 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+        except OSError as e:
+            print('could not write stats log:', e)
 bpy
 def item_check():
     global cam
@@ -274,84 +497,198 @@ def clean_up_first():
             pass         
     return {'FINISHED'}
     
-def join_bmeshes(bmesh_list):
-    # combine multiple bmeshes into a single bmesh
-    joined_bmesh = bmesh.new()
-    joined_bmesh.clear()
-    for bm in bmesh_list:
-        temp_mesh = bpy.data.meshes.new(name='temp_mesh')
-        bm.to_mesh(temp_mesh)
-        joined_bmesh.from_mesh(temp_mesh) # appends transformed data to the bmesh         
-    # returns bmesh 
-    return joined_bmesh 
- 
-def get_eval_mesh(obj):
+def get_eval_mesh(obj, world=True):
     #print('get_eval_mesh for ',obj.name)
+    # world: transform mesh by obj.matrix_world. (eval cache keeps meshes in local space, see object_geometry)
     # evaluate object, which applies all modifiers
     #new method in 2.83, see https://docs.blender.org/api/current/bpy.types.Depsgraph.html
     #also see https://developer.blender.org/T64735#681264
     depsgraph = bpy.context.evaluated_depsgraph_get()
     object_eval = obj.evaluated_get(depsgraph)
-    if(obj.type) in ['MESH','CURVE']:
-        # this method only works for meshes and curves. need alt method for GPENCIL objects.
-        #print('This object is a MESH or CURVE') 
-        data_copy = bpy.data.meshes.new_from_object(object_eval)
-        # also need to transform origin mesh, else they'll all be at 0,0,0
+    # only works for meshes and curves. grease pencil strokes are read directly, see gp_arrays
+    data_copy = bpy.data.meshes.new_from_object(object_eval)
+    count_stat('temp_datablocks')
+    # also need to transform origin mesh, else they'll all be at 0,0,0
+    if world:
         the_matrix = obj.matrix_world        
         data_copy.transform(the_matrix) # transform mesh using source object transforms  
-        return data_copy        
-    else: 
-        #this is a GPENCIL object (by process of elimination)
-        #print('This object is a GPENCIL')
-        #TODO: confirm that this is a GPENCIL object...
-        #if obj.type != 'GPENCIL':
-        #    print('Weird Object in VAMP Target Collection')
-        #    err_text = 'Please only use MESH, CURVE or GREASE PENCIL objects in VAMP target collection.'  
-        #    return False   
-        current_frame = scene.frame_current
-        gp = bpy.data.grease_pencils[0] # currently limited to just one GP object per project.
-        the_strokes = gp.layers.active.frames.data.frames.data.active_frame.strokes
-        
-        # create new curve based on points..
-        # see https://blender.stackexchange.com/questions/120074/how-to-make-a-curve-path-from-scratch-given-a-list-of-x-y-z-points
-        # coords_list = str.points
-        
-        # make a new curve
-        crv = bpy.data.curves.new(name='tempcurve', type='CURVE')  
-        crv.dimensions = '3D'   
-        
-        for str in the_strokes:
-            #print(str)
-            # for each stroke, make a new spline in that curve
-            #spline = crv.splines.new(type='NURBS') # nurbs makes curvy lines. Might be a nice option
-            spline = crv.splines.new(type='POLY') #sharp edges, good for hard surfaces & low poly            
-            # make room for a spline point for each GP stroke point
-            spline.points.add(len(str.points)-1) # there's already one point by default            
-            # assign the point coordinates to the spline points
-            #make a spline for each stroke
-            for num, pt in enumerate(str.points):
-                spline.points[num].co[0] = pt.co[0]
-                spline.points[num].co[1] = pt.co[1]
-                spline.points[num].co[2] = pt.co[2]    
-                spline.points[num].co[3] = 1   # needed for vertex 'weight'                
-        #crv data now exists, but need to convert it into mesh, then transform using world matrix.
-        GPCurvObj = bpy.data.objects.new(name='c',object_data = crv) # temporary object to facilitate output, will be deleted momentarily...
-        bpy.context.scene.collection.objects.link(GPCurvObj)  
-        data_copy = bpy.data.meshes.new_from_object(GPCurvObj)        
-        the_matrix = obj.matrix_world        
-        data_copy.transform(the_matrix) # transform mesh using source object transforms.  For generated GP objects, this s/b world origin.  
-        objs=bpy.data.objects
-        objs.remove(GPCurvObj, do_unlink=True)
-        return data_copy
+    return data_copy        
+
+# evaluated mesh cache. Every pipeline stage reads evaluated meshes from here, so each object 
+# is evaluated at most once per frame. Objects which haven't changed keep their mesh between frames.
+# meshes are kept in local space, so objects which only move don't need re-evaluating either.
+# grease pencil objects have no evaluated mesh (name is None), only the serial.
+eval_cache = {} # object name -> [fingerprint, evaluated mesh name, eval serial]
+EVAL_MESH_PREFIX = '_vampEval.' # evaluated meshes are named this + object name, so user meshes are never mistaken for them
+eval_serial = 0 # bumped on every evaluation, so later stages can tell when an object's shape changed
+eval_dirty = set() # object/data names edited since last evaluation, flagged by depsgraph handler
+# modifiers which change geometry over time, even if nothing else changes
+DYNAMIC_MODIFIERS = {'CLOTH','SOFT_BODY','DYNAMIC_PAINT','OCEAN','FLUID','FLUID_SIMULATION','PARTICLE_SYSTEM',
+    'PARTICLE_INSTANCE','EXPLODE','COLLISION','WAVE','MESH_SEQUENCE_CACHE','SURFACE','MESH_CACHE'}
+# geometry nodes which make a node tree depend on time or other objects
+DYNAMIC_NODES = {'GeometryNodeInputSceneTime','GeometryNodeObjectInfo','GeometryNodeCollectionInfo'}
+# animating these only moves an object, which matrix_world already covers
+TRANSFORM_PATHS = {'location','rotation_euler','rotation_quaternion','rotation_axis_angle','scale',
+    'delta_location','delta_rotation_euler','delta_rotation_quaternion','delta_scale'}
+
+def get_modifiers(obj):
+    if obj.type == 'GPENCIL':
+        return obj.grease_pencil_modifiers
+    return getattr(obj, 'modifiers', [])
+
+def modifier_targets(mod):
+    # other objects referenced by a modifier (armature, hook, boolean, mirror object etc)
+    targets = []
+    for prop in mod.bl_rna.properties:
+        if prop.type == 'POINTER':
+            val = getattr(mod, prop.identifier, None)
+            if isinstance(val, bpy.types.Object):
+                targets.append(val)
+    return targets
+
+def node_tree_is_dynamic(tree, depth=0):
+    if tree is None or depth > 8:
+        return False
+    for node in tree.nodes:
+        if node.bl_idname in DYNAMIC_NODES:
+            return True
+        if node.bl_idname == 'GeometryNodeGroup' and node_tree_is_dynamic(node.node_tree, depth + 1):
+            return True
+    return False
+
+def is_animated(obj, depth=0):
+    # True if evaluated geometry could change with the frame, even if nothing is edited
+    if depth > 4:
+        return True # deep dependency chain, don't try to be clever
+    if obj.type == 'GPENCIL':
+        for layer in obj.data.layers:
+            if len(layer.frames) > 1:
+                return True
+    for id_block in (obj, obj.data, getattr(obj.data, 'shape_keys', None)):
+        anim = getattr(id_block, 'animation_data', None)
+        if anim is None:
+            continue
+        if len(anim.nla_tracks) > 0:
+            return True
+        fcurves = list(anim.drivers)
+        if anim.action is not None:
+            fcurves.extend(anim.action.fcurves)
+        if id_block == obj:
+            # rigid motion only changes matrix_world, geometry stays the same
+            fcurves = [fc for fc in fcurves if fc.data_path not in TRANSFORM_PATHS]
+        if len(fcurves) > 0:
+            return True
+    for mod in get_modifiers(obj):
+        if mod.type in DYNAMIC_MODIFIERS:
+            return True
+        if mod.type == 'NODES' and node_tree_is_dynamic(mod.node_group):
+            return True
+        for target in modifier_targets(mod):
+            if target != obj and is_animated(target, depth + 1):
+                return True
+    return False
+
+def eval_fingerprint(obj):
+    # summary of everything that changes local space evaluated geometry: data, modifier stack.
+    # own transform only counts if a modifier uses other objects, as their relative position matters
+    fingerprint = [obj.data.name if obj.data else None]
+    for mod in get_modifiers(obj):
+        fingerprint.append((mod.name, mod.type, mod.show_viewport))
+        for target in modifier_targets(mod):
+            fingerprint.append(tuple(v for row in target.matrix_world for v in row))
+            fingerprint.append(tuple(v for row in obj.matrix_world for v in row))
+    if (bpy.context.scene.vamp_params.vamp_eval_cache is False) or is_animated(obj):
+        # only reuse within this frame
+        fingerprint.append(bpy.context.scene.frame_current)
+    return tuple(fingerprint)
+
+def get_cached_eval_mesh(obj):
+    # cached version of get_eval_mesh, in local space. Returned mesh is shared, so treat it as read only.
+    # grease pencil objects return None, but still get a new serial when they change (see local_geometry)
+    global eval_cache
+    global eval_dirty
+    global eval_serial
+    fingerprint = eval_fingerprint(obj)
+    entry = eval_cache.get(obj.name)
+    data_name = obj.data.name if obj.data else None
+    if entry is not None:
+        if entry[0] == fingerprint and obj.name not in eval_dirty and data_name not in eval_dirty:
+            if obj.type == 'GPENCIL':
+                count_stat('objects_reused')
+                return None
+            cached_mesh = get_eval_cache_mesh(entry)
+            if cached_mesh is not None:
+                count_stat('objects_reused')
+                return cached_mesh
+        # stale, remove old evaluated mesh
+        remove_eval_mesh(entry)
+    if obj.type == 'GPENCIL':
+        data_copy = None
+    else:
+        with profile_stage('evaluate'):
+            data_copy = get_eval_mesh(obj, world=False)
+            data_copy.name = EVAL_MESH_PREFIX + obj.name
+    count_stat('objects_evaluated')
+    eval_serial += 1
+    eval_cache[obj.name] = [fingerprint, data_copy.name if data_copy else None, eval_serial]
+    eval_dirty.discard(obj.name)
+    eval_dirty.discard(data_name)
+    return data_copy
+
+def get_eval_cache_mesh(entry):
+    # evaluated mesh of a cache entry, None if it's gone. Only VAMP's own unused meshes count
+    if entry[1] is None or not entry[1].startswith(EVAL_MESH_PREFIX):
+        return None
+    mesh = bpy.data.meshes.get(entry[1])
+    if mesh is None or mesh.users > 0:
+        return None
+    return mesh
+
+def remove_eval_mesh(entry):
+    old_mesh = get_eval_cache_mesh(entry)
+    if old_mesh is not None:
+        bpy.data.meshes.remove(old_mesh)
+
+def prune_eval_cache(keep_names):
+    # drop cache entries for objects no longer in VAMP target collection
+    global eval_cache
+    for obj_name in [n for n in eval_cache if n not in keep_names]:
+        remove_eval_mesh(eval_cache[obj_name])
+        del eval_cache[obj_name]
+    for obj_name in [n for n in geometry_cache if n not in keep_names]:
+        del geometry_cache[obj_name]
+    for obj_name in [n for n in occluder_cache if n not in keep_names]:
+        del occluder_cache[obj_name]
+
+@persistent
+def vamp_load_handler(dummy):
+    # new .blend loaded: forget everything cached from the old one. Its evaluated meshes 
+    # went with it, and their names could now belong to the new file's meshes, so nothing is removed.
+    global motion_state
+    eval_cache.clear()
+    eval_dirty.clear()
+    geometry_cache.clear()
+    occluder_cache.clear()
+    motion_state = None
+
+def vamp_depsgraph_handler(scene, depsgraph=None):
+    # flag objects whose geometry was edited, so get_cached_eval_mesh re-evaluates them
+    global eval_dirty
+    if depsgraph is None or len(eval_cache) == 0:
+        return
+    for update in depsgraph.updates:
+        if update.is_updated_geometry:
+            eval_dirty.add(update.id.original.name)
         
     
 def in_range(obj):
     #used with culling.  Identifies whether object origins are within culling range
+    #(frustum cull uses whole bounding box instead, see frustum_cull)
     global cam
     cam_loc = cam.matrix_world.decompose()[0]
     obj_loc = obj.matrix_world.decompose()[0]
     cull_dist = bpy.context.scene.vamp_params.vamp_cull_dist
-    if bpy.context.scene.vamp_params.vamp_cull == False:
+    if bpy.context.scene.vamp_params.vamp_cull == False or bpy.context.scene.vamp_params.vamp_frustum_cull:
         return True
     else:    
         if(distance(obj_loc,cam_loc) < cull_dist):
@@ -359,9 +696,66 @@ def in_range(obj):
         else:
             return False
         
+def object_corners(obj, depsgraph):
+    # world space corners of evaluated object's bounding box, shape (8,3)
+    obj_eval = obj.evaluated_get(depsgraph)
+    corners = np.array([c[:] for c in obj_eval.bound_box], dtype=np.float64)
+    mat = np.array(obj_eval.matrix_world)
+    return corners @ mat[:3, :3].T + mat[:3, 3]
+
+def outside_crop(corners, view):
+    # True if every bbox corner is on the wrong side of one crop plane, so none of object's edges survive crop
+    crop_mode = bpy.context.scene.vamp_params.vamp_crop_enum
+    if crop_mode == 'None':
+        return False
+    mat_inv, frame, ortho = view
+    co_local = corners @ mat_inv[:3, :3].T + mat_inv[:3, 3]
+    x, y, z = co_local[:, 0], co_local[:, 1], -co_local[:, 2]
+    if crop_mode == 'Front':
+        return bool(np.all(z < .01))
+    if np.all(z <= 0):
+        return True
+    # frame sides. (view frame corners 0,1,2 are top right, bottom right, bottom left)
+    if ortho:
+        sides = (x - frame[2, 0], frame[1, 0] - x, y - frame[1, 1], frame[0, 1] - y)
+    else:
+        d = -frame[0, 2]
+        sides = (x * d - frame[2, 0] * z, frame[1, 0] * z - x * d, y * d - frame[1, 1] * z, frame[0, 1] * z - y * d)
+    return any(np.all(side < 0) for side in sides)
+
+def frustum_cull(objs):
+    # splits objs into edge objects (might show up in output) & occluder objects 
+    # (can't show up, but rays from edge objects could still hit them). everything else is dropped.
+    # off-screen objects never block, since all rays stay inside the camera's view.
+    # objects past cull radius can only block silhouette rays cast away from camera.
+    vampparams = bpy.context.scene.vamp_params
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    view = get_frame_view()
+    cam_loc = np.array(cam.matrix_world.to_translation())
+    edge_objs = []
+    far_objs = []
+    max_dist = 0.0
+    for obj in objs:
+        corners = object_corners(obj, depsgraph)
+        if outside_crop(corners, view):
+            continue
+        nearest = np.clip(cam_loc, corners.min(axis=0), corners.max(axis=0))
+        near_dist = float(np.sqrt(((nearest - cam_loc) ** 2).sum()))
+        if vampparams.vamp_cull and near_dist >= vampparams.vamp_cull_dist:
+            far_objs.append((obj, near_dist))
+        else:
+            edge_objs.append(obj)
+            max_dist = max(max_dist, float(np.sqrt(((corners - cam_loc) ** 2).sum(axis=1)).max()))
+    occluders = []
+    if not vampparams.vamp_sil_contour:
+        reach = max_dist + min(vampparams.vamp_raycast_dist, max_dist)
+        occluders = [obj for obj, near_dist in far_objs if near_dist < reach]
+    return edge_objs, occluders
+
 def mark_inrange():
     #used with culling. Generates a list of objects within culling radius from camera
     global inrange_objs
+    global occluder_objs
     #inrange_objs = []
     target_name = bpy.context.scene.vamp_params.vamp_target
     ok_types = ['MESH','CURVE','GPENCIL']
@@ -374,147 +768,345 @@ def mark_inrange():
             obj["vamp_inrange"] = False    
             print('tested object (',obj,') is wrong type, or is not in range')            
     inrange_objs = [obj for obj in bpy.data.collections[target_name].objects if obj["vamp_inrange"] == True]
+    occluder_objs = []
+    if bpy.context.scene.vamp_params.vamp_frustum_cull:
+        inrange_objs, occluder_objs = frustum_cull(inrange_objs)
+        print('frustum cull: ',len(inrange_objs),'objects in view, ',len(occluder_objs),'kept as occluders')
     print('inrange_objs count: ',len(inrange_objs))    
     
+# array geometry. Evaluated meshes are read in bulk (foreach_get) into local space arrays, which are 
+# cached along with the evaluated mesh, and moved into world space with one matmul. Each frame, all objects 
+# are joined into one SceneGeometry for occluders, and a welded copy of its edges is the edge source.
+geometry_cache = {} # object name -> [eval serial, local arrays (see mesh_arrays), matrix_world, world arrays]
+
+def foreach_array(seq, attr, dtype, width=1):
+    # bulk read of one attribute of a mesh collection. shape (len(seq),width), or (len(seq),) for width 1
+    out = np.empty(len(seq) * width, dtype=dtype)
+    seq.foreach_get(attr, out)
+    return out.reshape(-1, width) if width > 1 else out
+
+def mesh_arrays(mesh):
+    # verts, edges & loop triangles (vertex indices), face normals & centers, face & edge of 
+    # each face corner (loop_face, loop_edge), and marked: freestyle marked or sharp edges
+    mesh.calc_loop_triangles()
+    loop_totals = foreach_array(mesh.polygons, 'loop_total', np.int32)
+    return {'verts': foreach_array(mesh.vertices, 'co', np.float32, 3),
+        'edges': foreach_array(mesh.edges, 'vertices', np.int32, 2),
+        'tris': foreach_array(mesh.loop_triangles, 'vertices', np.int32, 3),
+        'face_normals': foreach_array(mesh.polygons, 'normal', np.float32, 3),
+        'face_centers': foreach_array(mesh.polygons, 'center', np.float32, 3),
+        'loop_face': np.repeat(np.arange(len(loop_totals), dtype=np.int32), loop_totals),
+        'loop_edge': foreach_array(mesh.loops, 'edge_index', np.int32),
+        'marked': foreach_array(mesh.edges, 'use_freestyle_mark', bool) | 
+            foreach_array(mesh.edges, 'use_edge_sharp', bool)}
+
+def gp_arrays(obj):
+    # grease pencil strokes of every visible layer (each at its current frame), as lines in the same
+    # form as mesh_arrays: stroke points, & an edge between each pair of neighbouring points. no faces.
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    gp = obj.evaluated_get(depsgraph).data # includes grease pencil modifiers
+    stroke_cos = []
+    cyclic = []
+    for layer in gp.layers:
+        if layer.hide or layer.active_frame is None:
+            continue
+        for stroke in layer.active_frame.strokes:
+            if len(stroke.points) > 0:
+                stroke_cos.append(foreach_array(stroke.points, 'co', np.float32, 3))
+                cyclic.append(stroke.use_cyclic and len(stroke.points) > 2)
+    counts = np.array([len(co) for co in stroke_cos], dtype=np.int32)
+    starts = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+    verts = np.concatenate(stroke_cos) if stroke_cos else np.zeros((0, 3), dtype=np.float32)
+    # consecutive points, except across the gap from one stroke to the next
+    idx = np.arange(len(verts) - 1, dtype=np.int32)
+    idx = idx[~np.isin(idx + 1, starts)]
+    cyclic = np.array(cyclic, dtype=bool)
+    closing = np.stack((starts[1:][cyclic] - 1, starts[:-1][cyclic]), axis=1)
+    edges = np.concatenate((np.stack((idx, idx + 1), axis=1), closing)).astype(np.int32)
+    no_faces = np.zeros((0, 3), dtype=np.float32)
+    no_loops = np.zeros(0, dtype=np.int32)
+    return {'verts': verts, 'edges': edges, 'tris': np.zeros((0, 3), dtype=np.int32),
+        'face_normals': no_faces, 'face_centers': no_faces, 'loop_face': no_loops, 'loop_edge': no_loops,
+        'marked': np.zeros(len(edges), dtype=bool)}
+
+def local_geometry(obj):
+    # local space arrays of evaluated obj, only read again when it's re-evaluated
+    mesh = get_cached_eval_mesh(obj)
+    serial = eval_cache[obj.name][2]
+    entry = geometry_cache.get(obj.name)
+    if entry is None or entry[0] != serial:
+        if mesh is None:
+            with profile_stage('evaluate'):
+                arrays = gp_arrays(obj)
+        else:
+            arrays = mesh_arrays(mesh)
+        entry = [serial, arrays, None, None]
+        geometry_cache[obj.name] = entry
+    return entry
+
+def object_geometry(obj):
+    # world space arrays of evaluated obj
+    entry = local_geometry(obj)
+    matrix = tuple(v for row in obj.matrix_world for v in row)
+    if entry[2] != matrix:
+        local = entry[1]
+        mat = np.array(obj.matrix_world, dtype=np.float64)
+        # normals go through inverse transpose, so non-uniform scale keeps them square to their faces
+        normal_mat = np.array(obj.matrix_world.to_3x3().inverted_safe(), dtype=np.float64)
+        normals = local['face_normals'] @ normal_mat
+        lengths = np.sqrt((normals * normals).sum(axis=1))
+        world = dict(local)
+        world['verts'] = (local['verts'] @ mat[:3, :3].T + mat[:3, 3]).astype(np.float32)
+        world['face_centers'] = (local['face_centers'] @ mat[:3, :3].T + mat[:3, 3]).astype(np.float32)
+        world['face_normals'] = (normals / np.where(lengths > 0, lengths, 1)[:, None]).astype(np.float32)
+        entry[2] = matrix
+        entry[3] = world
+    return entry[3]
+
+class SceneGeometry:
+    # world space geometry of several objects (or lines), as flat arrays:
+    #   verts (n,3), edges (m,2) & tris (k,3) vertex indices, face_normals & face_centers (f,3),
+    #   loop_face & loop_edge: face & edge of each face corner, marked: per edge, see mesh_arrays
+    #   edge_obj, tri_obj, face_obj: which of the joined parts each edge, triangle & face came from
+    def __init__(self, verts, edges, tris, face_normals, face_centers, loop_face, loop_edge, 
+            marked, edge_obj, tri_obj, face_obj):
+        self.verts = verts
+        self.edges = edges
+        self.tris = tris
+        self.face_normals = face_normals
+        self.face_centers = face_centers
+        self.loop_face = loop_face
+        self.loop_edge = loop_edge
+        self.marked = marked
+        self.edge_obj = edge_obj
+        self.tri_obj = tri_obj
+        self.face_obj = face_obj
+    
+    def select(self, edge_keep, part_ids=None):
+        # same verts, only edges where edge_keep. part_ids (optional): only keep faces & triangles of these parts
+        edge_ids = np.flatnonzero(edge_keep)
+        edge_map = np.full(len(self.edges) + 1, -1, dtype=np.int32) # last slot: loops of dropped edges
+        edge_map[edge_ids] = np.arange(len(edge_ids), dtype=np.int32)
+        loop_edge = edge_map[self.loop_edge]
+        loop_keep = loop_edge >= 0
+        tri_keep = np.ones(len(self.tris), dtype=bool)
+        if part_ids is not None:
+            tri_keep = np.isin(self.tri_obj, part_ids)
+            loop_keep &= np.isin(self.face_obj, part_ids)[self.loop_face]
+        return SceneGeometry(self.verts, self.edges[edge_ids], self.tris[tri_keep], self.face_normals, 
+            self.face_centers, self.loop_face[loop_keep], loop_edge[loop_keep], self.marked[edge_ids],
+            self.edge_obj[edge_ids], self.tri_obj[tri_keep], self.face_obj)
+    
+    def add_lines(self, verts, edges):
+        # same geometry plus loose lines (not welded to existing verts), which count as part -1
+        return SceneGeometry(np.concatenate((self.verts, verts)).astype(np.float32, copy=False), 
+            np.concatenate((self.edges, edges + len(self.verts))).astype(np.int32, copy=False), self.tris, 
+            self.face_normals, self.face_centers, self.loop_face, self.loop_edge, 
+            np.concatenate((self.marked, np.zeros(len(edges), dtype=bool))),
+            np.concatenate((self.edge_obj, np.full(len(edges), -1, dtype=np.int32))), self.tri_obj, self.face_obj)
+    
+    def welded(self):
+        # edge source version: verts used by edges & triangles welded in one go, like remove_doubles, then 
+        # zero length & duplicate edges dropped. Occluders stay unwelded, so small detail still hides lines.
+        used = np.unique(np.concatenate((self.edges.reshape(-1), self.tris.reshape(-1))))
+        first_idx, inverse = weld_points(self.verts[used], weld_dist)
+        vert_map = np.zeros(len(self.verts), dtype=np.int32)
+        vert_map[used] = inverse
+        verts = self.verts[used][first_idx]
+        edges = vert_map[self.edges].reshape(-1, 2)
+        tris = vert_map[self.tris].reshape(-1, 3)
+        # keep first of each duplicate edge, zero length ones go.
+        # only duplicates within a part are merged, so each object keeps all its own edges (for Ind Sil)
+        edge_rows = np.column_stack((self.edge_obj, np.sort(edges, axis=1))).astype(np.int64)
+        edge_rows[edges[:, 0] == edges[:, 1]] = -1
+        edge_keys = edge_rows.view(np.dtype((np.void, edge_rows.dtype.itemsize * 3))).reshape(-1)
+        uniq_keys, first_edge, edge_map = np.unique(edge_keys, return_index=True, return_inverse=True)
+        uniq_ok = edge_rows[first_edge, 1] >= 0
+        new_index = np.where(uniq_ok, np.cumsum(uniq_ok) - 1, -1)
+        edge_map = new_index[edge_map.reshape(-1)]
+        first_edge = first_edge[uniq_ok]
+        # duplicate edge is marked if any of its copies is
+        edge_marked = np.zeros(len(first_edge), dtype=bool)
+        np.logical_or.at(edge_marked, edge_map[edge_map >= 0], self.marked[edge_map >= 0])
+        loop_edge = edge_map[self.loop_edge] if len(edge_map) > 0 else self.loop_edge
+        loop_keep = loop_edge >= 0
+        tri_keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+        return SceneGeometry(verts, edges[first_edge], tris[tri_keep], self.face_normals, self.face_centers, 
+            self.loop_face[loop_keep], loop_edge[loop_keep], edge_marked, self.edge_obj[first_edge], 
+            self.tri_obj[tri_keep], self.face_obj)
+
+def concat_arrays(arrays, width, dtype):
+    if len(arrays) == 0:
+        return np.empty((0, width) if width > 1 else 0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+def join_geometry(parts):
+    # join geometry dicts (see mesh_arrays. only verts & edges are needed) into one SceneGeometry:
+    # indices are offset part by part. Not welded, see SceneGeometry.welded for edge sources
+    verts, edges, tris, normals, centers, loop_face, loop_edge, marked = [], [], [], [], [], [], [], []
+    edge_obj, tri_obj, face_obj = [], [], []
+    vert_offset = edge_offset = face_offset = 0
+    for part_n, part in enumerate(parts):
+        part_edges = part['edges']
+        verts.append(part['verts'])
+        edges.append(part_edges + vert_offset)
+        edge_obj.append(np.full(len(part_edges), part_n, dtype=np.int32))
+        marked.append(part.get('marked', np.zeros(len(part_edges), dtype=bool)))
+        face_count = 0
+        if 'tris' in part:
+            face_count = len(part['face_normals'])
+            tris.append(part['tris'] + vert_offset)
+            tri_obj.append(np.full(len(part['tris']), part_n, dtype=np.int32))
+            normals.append(part['face_normals'])
+            centers.append(part['face_centers'])
+            face_obj.append(np.full(face_count, part_n, dtype=np.int32))
+            loop_face.append(part['loop_face'] + face_offset)
+            loop_edge.append(part['loop_edge'] + edge_offset)
+        vert_offset += len(part['verts'])
+        edge_offset += len(part_edges)
+        face_offset += face_count
+    verts = concat_arrays(verts, 3, np.float32)
+    edges = concat_arrays(edges, 2, np.int32)
+    tris = concat_arrays(tris, 3, np.int32)
+    loop_edge = concat_arrays(loop_edge, 1, np.int32)
+    loop_face = concat_arrays(loop_face, 1, np.int32)
+    marked = concat_arrays(marked, 1, bool)
+    edge_obj = concat_arrays(edge_obj, 1, np.int32)
+    tri_obj = concat_arrays(tri_obj, 1, np.int32)
+    return SceneGeometry(verts, edges, tris, concat_arrays(normals, 3, np.float32), 
+        concat_arrays(centers, 3, np.float32), loop_face, loop_edge, marked, 
+        edge_obj, tri_obj, concat_arrays(face_obj, 1, np.int32))
+
 def get_all_the_stuff():
-    #outputs bm_all
-    global bm_all
+    #outputs frame_geometry: all in range & occluder-only objects, joined, unwelded. Occluders for hit testing.
+    #edge_geometry: just the edges of in range objects, welded. Edge source for visibility.
+    global frame_geometry
+    global edge_geometry
     global original_edge_count
-    global inrange_objs
-    target_name = bpy.context.scene.vamp_params.vamp_target
-    bm_all = bmesh.new()
-    new_edges=0
-    for obj in inrange_objs:
-        data_copy=get_eval_mesh(obj)
-        if data_copy:
-            new_edges += len(data_copy.edges)
-            bm_all.from_mesh(data_copy) # appends transformed data to the bmesh
-        else:
-            #something went wrong when getting data_copy. Abort.
-            print('fail. exiting get_all_the_stuff')
-            err_text = 'Something went wrong. Aborting. Check System Console.'  
-            return False                
-    
-    original_edge_count=new_edges # will test against edge limit. if too high, just quit.
-    # bm_all now contains bmesh containing all data we need for next step
-    # we will also use it later for BVHTree hit testing     
+    parts = [object_geometry(obj) for obj in inrange_objs + occluder_objs]
+    original_edge_count = sum(len(part['edges']) for part in parts[:len(inrange_objs)]) # will test against edge limit. if too high, just quit.
+    frame_geometry = join_geometry(parts)
+    edge_geometry = frame_geometry.select(frame_geometry.edge_obj < len(inrange_objs)).welded()
     return {'FINISHED'}
 
 def get_marked_edges():
-    #creates bm_marked
-    #iterate thru all objects in group, find marked edges, 
-    #create a single new BM comprising only marked edges
-    target_name = bpy.context.scene.vamp_params.vamp_target
-    global bm_marked
-    global inrange_objs
-    bm_marked = bmesh.new()
-    bm_marked.clear()
-    print('Iterating Marked Edges now.')
-    for obj in [obj for obj in inrange_objs if obj.type == 'MESH']:
-        # evaluate object, which applies all modifiers
-        data_copy=get_eval_mesh(obj)
-        counter = 0
-        marked_list = []
-        for e in data_copy.edges:
-            if (e.use_freestyle_mark is True or e.use_edge_sharp is True):
-                marked_list.append(counter)
-            counter += 1             
-        
-        marked_edge_list = []
-        if len(marked_list) > 0: 
-            #if we found some, gen a list of edges & vertices
-            for i in marked_list:
-                edge_start = data_copy.edges[i].vertices[0]
-                edge_end = data_copy.edges[i].vertices[1]
-                this_edge = [edge_start,edge_end]
-                marked_edge_list.append(this_edge)
-    
-            marked_vert_list = []
-            for v in data_copy.vertices:
-                marked_vert_list.append(v.co)            
-            marked_face_list = []
-            #build new mesh with marked data
-            nu_marked_mesh = bpy.data.meshes.new(name='New Marked')
-            nu_marked_mesh.from_pydata(marked_vert_list,marked_edge_list,marked_face_list)
-            bm_marked.from_mesh(nu_marked_mesh) # appends transformed data to the bmesh  
-        
-        #1.02: added crease mode
-        # if crease mode is active, also include creased edges
-        if bpy.context.scene.vamp_params.vamp_crease_mode is True:
-            creased_list = [] 
-            bm_creased = bmesh.new()
-            bm_creased.clear()
-            bm_creased.from_mesh(data_copy)
-            vamp_crease_limit = bpy.context.scene.vamp_params.vamp_crease_limit  #(convert to radians)
-            uncreased_edges = []
-            
-            for e in bm_creased.edges:    
-                if len(e.link_faces) == 2:
-                    #make sure 2 faces exist..
-                    angle=round(e.calc_face_angle_signed()*57.2958,1)
-                    if abs(angle) < (180 - vamp_crease_limit):
-                        # calc'd angle goes from zero (flat) to 179 (very acute)
-                        # UI is based on more user friendly protractor style measure
-                        uncreased_edges.append(e)
-                        # if too flat, add into list to be deleted.
-            bmesh.ops.delete(bm_creased, geom=uncreased_edges, context='EDGES') 
-            temp_crease_mesh = bpy.data.meshes.new(name='temp_crease_mesh')
-            bm_creased.to_mesh(temp_crease_mesh)
-            bm_marked.from_mesh(temp_crease_mesh) # appends transformed data to the bmesh
-            bm_creased.clear()
-            
-    # bm_marked now contains a single bm, with ONLY freestyle-marked edges
-    return {'FINISHED'}      
+    #returns which edge_geometry edges are freestyle-marked (or sharp) edges of in range MESH objects, 
+    #plus creased edges in crease mode.
+    geom = edge_geometry
+    mesh_parts = [n for n, obj in enumerate(inrange_objs) if obj.type == 'MESH']
+    mesh_edge = np.isin(geom.edge_obj, mesh_parts)
+    keep = geom.marked & mesh_edge
     
-def get_sep_meshes():
-    # iterate the original list, generate a LIST of individual meshes for further analysis
-    global sep_meshes
-    global inrange_objs
-    target_name = bpy.context.scene.vamp_params.vamp_target
-    sep_meshes = []  
-    bm_all = bmesh.new() 
-    bm_all.clear()
-    for obj in inrange_objs:
-        bm_obj = bmesh.new()              
-        # evaluate object, which applies all modifiers
-        data_copy=get_eval_mesh(obj)
-        bm_obj.from_mesh(data_copy) # appends transformed data to the bmesh
-        sep_meshes.append(bm_obj)
-    # sep_meshes now contains multiple bmeshes, one each for original objects.
-    return {'FINISHED'}    
-
-def rebuild_bmesh(bm):
-    #Cleans up bmesh to join adjacent edges, remove mid-edge vertices
-    #from https://blender.stackexchange.com/a/92419/49532
-    bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=0.01)
-    not_corners = [v for v in bm.verts if not is_corner(v)]
-    bmesh.ops.dissolve_verts(bm, verts=not_corners)
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-    bm.faces.ensure_lookup_table()
-    return(bm)
-    
-    
-def empty_trash():
-    #modified from: https://blender.stackexchange.com/a/132724/49532        
-    trash = [o for o in bpy.data.meshes
-            if o.users == 0]   
-    while(trash):
-        bpy.data.meshes.remove(trash.pop())
-    
-def is_corner(v):
-    #from https://blender.stackexchange.com/a/92419/49532
-    #MIN_ANGLE = radians(5)
-    MIN_ANGLE = radians(.5)
-    if len(v.link_edges) != 2:
-        return False
-    e1, e2 = v.link_edges[:]
-    v1 = e1.other_vert(v).co - v.co
-    v2 = e2.other_vert(v).co - v.co
-    # need error trap if .co is same for any of these.
-    return v1.angle(-v2) >= radians(MIN_ANGLE)
+    #1.02: added crease mode
+    # if crease mode is active, also include creased edges
+    if bpy.context.scene.vamp_params.vamp_crease_mode is True:
+        vamp_crease_limit = bpy.context.scene.vamp_params.vamp_crease_limit
+        face_count = np.bincount(geom.loop_edge, minlength=len(geom.edges))
+        # edges without exactly 2 faces always count as creased
+        creased = face_count != 2
+        two_face = np.flatnonzero(face_count == 2)
+        if len(two_face) > 0:
+            loop_order = np.argsort(geom.loop_edge, kind='stable')
+            first_loop = (np.cumsum(face_count) - face_count)[two_face]
+            face0 = geom.loop_face[loop_order[first_loop]]
+            face1 = geom.loop_face[loop_order[first_loop + 1]]
+            cos_angle = (geom.face_normals[face0] * geom.face_normals[face1]).sum(axis=1)
+            angle = np.round(np.degrees(np.arccos(np.clip(cos_angle, -1, 1))), 1)
+            # calc'd angle goes from zero (flat) to 179 (very acute)
+            # UI is based on more user friendly protractor style measure
+            creased[two_face] = angle >= (180 - vamp_crease_limit)
+        keep |= creased & mesh_edge
+    # only freestyle-marked (and creased) edges
+    return keep
+    
+class TempArena:
+    # owns throwaway bmeshes & datablocks, and frees them all in release().
+    # run_arena lasts one VAMP run.
+    def __init__(self):
+        self.bmeshes = []
+        self.blocks = [] # objects first, so their data has no users left by the time it goes
+    
+    def keep(self, item):
+        # take ownership of an existing bmesh or datablock. returns it
+        if isinstance(item, bmesh.types.BMesh):
+            self.bmeshes.append(item)
+        elif isinstance(item, bpy.types.Object):
+            self.blocks.insert(0, item)
+        else:
+            self.blocks.append(item)
+        return item
+    
+    def bmesh(self):
+        return self.keep(bmesh.new())
+    
+    def release(self):
+        for bm in self.bmeshes:
+            bm.free() # no-op if already freed
+        live_blocks = []
+        for block in self.blocks:
+            try:
+                block.name
+            except ReferenceError:
+                continue # removed already
+            live_blocks.append(block)
+        if len(live_blocks) > 0:
+            bpy.data.batch_remove(ids=live_blocks)
+        self.bmeshes = []
+        self.blocks = []
+
+run_arena = TempArena() # temporaries of current VAMP run, see run_in_arena
+
+def run_in_arena(steps):
+    # runs steps generator, then frees its temporaries, even if it stops part way (cancel or error)
+    try:
+        return (yield from steps)
+    finally:
+        run_arena.release()
 
+# memory watchdog. After each frame, datablock counts & process memory are compared with the frame
+# before. Growth goes into frame stats, and a steady climb over watchdog_frames frames is reported.
+watchdog_frames = 10
+watchdog_last = None # memory_snapshot() after previous frame
+watchdog_climb = 0 # frames in a row datablock count went up
 
+def rss_mb():
+    # resident memory of Blender process, MB. None where not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource # peak rather than current, but still shows growth
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def memory_snapshot():
+    return {'meshes': len(bpy.data.meshes), 'curves': len(bpy.data.curves), 
+        'objects': len(bpy.data.objects), 'rss_mb': rss_mb()}
+
+def watchdog_check():
+    # compare memory with previous frame, add result to frame_stats
+    global watchdog_last
+    global watchdog_climb
+    now = memory_snapshot()
+    last = watchdog_last
+    watchdog_last = now
+    datablocks = now['meshes'] + now['curves'] + now['objects']
+    memory = {'datablocks': datablocks, 'rss_mb': now['rss_mb']}
+    if last is not None:
+        memory['datablock_growth'] = datablocks - (last['meshes'] + last['curves'] + last['objects'])
+        if now['rss_mb'] is not None and last['rss_mb'] is not None:
+            memory['rss_growth_mb'] = round(now['rss_mb'] - last['rss_mb'], 3)
+        watchdog_climb = watchdog_climb + 1 if memory['datablock_growth'] > 0 else 0
+        if watchdog_climb == watchdog_frames:
+            print('VAMP watchdog: datablocks went up', watchdog_frames, 'frames in a row, now', 
+                {name: now[name] for name in ('meshes', 'curves', 'objects')})
+    if frame_stats is not None:
+        frame_stats['memory'] = memory
+    
 def is_endpoint(v):
     #not currently used
     #from https://blender.stackexchange.com/a/92419/49532
@@ -523,25 +1115,275 @@ def is_endpoint(v):
     else:
         return False
     
-def denoise(bm):
+def denoise(verts, edges):
     # remove edges below x threshold.  Can remove 100%, or random % sample
     global denoise_thresh
     #denoise_thresh = .5 #blender units
     denoise_thresh = bpy.context.scene.vamp_params.vamp_denoise_thresh    
     denoise_pct = bpy.context.scene.vamp_params.vamp_denoise_pct
     
-    #if denoise is switched on, iterate thru bmesh edges, delete all which are < threshold length.
-    noisy_edges = [e for e in bm.edges if e.calc_length() < denoise_thresh]
+    #if denoise is switched on, find all edges which are < threshold length.
+    edge_vects = verts[edges[:, 1]] - verts[edges[:, 0]]
+    noisy_edges = np.flatnonzero(np.sqrt((edge_vects * edge_vects).sum(axis=1)) < denoise_thresh).tolist()
     # delete subset only.
     hitlist = int(len(noisy_edges)*denoise_pct)
     del_edges = sample(noisy_edges,hitlist)
-    bmesh.ops.delete(bm, geom=del_edges, context='EDGES')
-    bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=denoise_thresh)
-    return(bm)
+    keep = np.ones(len(edges), dtype=bool)
+    keep[del_edges] = False
+    # then merge what's left within threshold, like remove_doubles
+    first_idx, inverse = weld_points(verts, max(denoise_thresh, 0.00001))
+    edges = inverse[edges[keep]].reshape(-1, 2)
+    return verts[first_idx], edges[edges[:, 0] != edges[:, 1]]
 
 def distance(loc0,loc1):
     return (loc0-loc1).length    
 
+# two level occluders: per object BVHTrees in local space, cached until the object's shape changes, 
+# under a flat top level of world space bounding boxes which is rebuilt every frame.
+occluder_cache = {} # object name -> [eval serial, local space BVHTree]
+
+def get_occluder_bvh(obj):
+    # local space BVH for one object. Moving/rotating the object doesn't need a rebuild.
+    if obj.type not in ['MESH','CURVE']:
+        return None # grease pencil strokes have no faces, can't occlude
+    serial, local = local_geometry(obj)[:2]
+    entry = occluder_cache.get(obj.name)
+    if entry is not None and entry[0] == serial:
+        return entry[1]
+    local_bvh = mathutils.bvhtree.BVHTree.FromPolygons(local['verts'].tolist(), local['tris'].tolist(), epsilon = 0.00)
+    occluder_cache[obj.name] = [serial, local_bvh]
+    return local_bvh
+
+class OccluderSet:
+    # top level of the two level occluders. Has the same ray_cast() as BVHTree, 
+    # so hit_test_bvh can use it, plus hits_batch() for the batch engine.
+    def __init__(self, objs):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        self.entries = []
+        for obj in objs:
+            local_bvh = get_occluder_bvh(obj)
+            if local_bvh is None:
+                continue
+            mat = obj.matrix_world.copy()
+            corners = np.array([mat @ Vector(c) for c in obj.evaluated_get(depsgraph).bound_box])
+            pad = (corners.max(axis=0) - corners.min(axis=0)) * 0.001 + 0.001
+            self.entries.append((local_bvh, mat, mat.inverted_safe(), 
+                corners.min(axis=0) - pad, corners.max(axis=0) + pad))
+    
+    def ray_cast(self, origin, direction, distance):
+        # nearest hit over all objects, in world space. (index is per object)
+        origin = Vector(origin)
+        direction = Vector(direction)
+        seg = np.array([origin[:]]), np.array([(origin + direction * distance)[:]])
+        nearest = (None, None, None, None)
+        for local_bvh, mat, mat_inv, box_min, box_max in self.entries:
+            if not segments_hit_box(seg[0], seg[1], box_min, box_max)[0]:
+                continue
+            local_dir = mat_inv.to_3x3() @ direction
+            scale = local_dir.length
+            if scale == 0:
+                continue
+            (loc,norm,indx,dist) = local_bvh.ray_cast(mat_inv @ origin, local_dir / scale, distance * scale)
+            if loc is not None and (nearest[3] is None or dist / scale < nearest[3]):
+                world_norm = (mat_inv.to_3x3().transposed() @ norm).normalized()
+                nearest = (mat @ loc, world_norm, indx, dist / scale)
+        return nearest
+    
+    def hits_batch(self, origins, directions, ray_dists):
+        # True where ray hits anything. Rays are only cast into objects whose bounds they cross.
+        hits = np.zeros(len(origins), dtype=bool)
+        ends = origins + directions * ray_dists[:, None]
+        for local_bvh, mat, mat_inv, box_min, box_max in self.entries:
+            cand = np.flatnonzero(~hits & segments_hit_box(origins, ends, box_min, box_max))
+            if len(cand) == 0:
+                continue
+            inv = np.array(mat_inv)
+            local_origins = origins[cand] @ inv[:3, :3].T + inv[:3, 3]
+            local_dirs = directions[cand] @ inv[:3, :3].T
+            scales = np.sqrt((local_dirs * local_dirs).sum(axis=1))
+            ok = scales > 0
+            local_dirs[ok] /= scales[ok, None]
+            local_dists = ray_dists[cand] * scales
+            ray_cast = local_bvh.ray_cast
+            hits[cand] = [ok_ray and ray_cast(o, d, r)[0] is not None for ok_ray, o, d, r in 
+                zip(ok.tolist(), local_origins.tolist(), local_dirs.tolist(), local_dists.tolist())]
+        return hits
+
+def get_occluders(mask, mask_objs=None):
+    # occluders for hit testing, from triangles of mask (SceneGeometry). With Cache BVH on, uses the 
+    # two level cached version, built from the objects which make up mask
+    with profile_stage('bvh'):
+        if bpy.context.scene.vamp_params.vamp_bvh_cache and mask_objs is not None:
+            return OccluderSet(mask_objs)
+        return mathutils.bvhtree.BVHTree.FromPolygons(mask.verts.tolist(), mask.tris.tolist(), epsilon = 0.00)
+
+def clip_near(tris, depths, near):
+    # clip camera space triangles (n,3,3) against depth = near. depths (n,3) is distance in front of camera.
+    # triangles partly behind the plane are cut down to the part in front (1 or 2 triangles)
+    inside = depths >= near
+    in_count = inside.sum(axis=1)
+    out = [tris[in_count == 3]]
+    for count in (1, 2):
+        sel = np.flatnonzero(in_count == count)
+        if len(sel) == 0:
+            continue
+        # roll each triangle so the odd vertex (only in / only out) comes first
+        odd = np.argmax(inside[sel] == (count == 1), axis=1)
+        order = (odd[:, None] + np.arange(3)) % 3
+        tri = tris[sel][np.arange(len(sel))[:, None], order]
+        dep = depths[sel][np.arange(len(sel))[:, None], order]
+        def cut(i, j):
+            t = ((near - dep[:, i]) / (dep[:, j] - dep[:, i]))[:, None]
+            return tri[:, i] + t * (tri[:, j] - tri[:, i])
+        a_b, a_c = cut(0, 1), cut(0, 2)
+        if count == 1:
+            out.append(np.stack((tri[:, 0], a_b, a_c), axis=1))
+        else:
+            out.append(np.stack((a_b, tri[:, 1], tri[:, 2]), axis=1))
+            out.append(np.stack((a_b, tri[:, 2], a_c), axis=1))
+    return np.concatenate(out)
+
+def rasterize_depth(tris, view, width, height, near=0.001):
+    # CPU depth buffer. Returns nearest & farthest depth (distance in front of camera) per pixel, 
+    # shape (height, width). empty pixels are inf / -inf. Perspective cameras only.
+    mat_inv, frame, ortho = view
+    depth_min = np.full(width * height, np.inf)
+    depth_max = np.full(width * height, -np.inf)
+    cam_tris = tris.reshape(-1, 3).astype(np.float64) @ mat_inv[:3, :3].T + mat_inv[:3, 3]
+    cam_tris = cam_tris.reshape(-1, 3, 3)
+    cam_tris = clip_near(cam_tris, -cam_tris[:, :, 2], near)
+    depths = -cam_tris[:, :, 2]
+    frame_depth = -frame[0, 2]
+    # pixel coords, same mapping as project_points
+    sx = (cam_tris[:, :, 0] * frame_depth / depths - frame[2, 0]) / (frame[1, 0] - frame[2, 0]) * width
+    sy = (cam_tris[:, :, 1] * frame_depth / depths - frame[1, 1]) / (frame[0, 1] - frame[1, 1]) * height
+    # pixels whose centers might be inside each triangle
+    x0 = np.clip(np.ceil(sx.min(axis=1) - 0.5), 0, width).astype(np.int64)
+    x1 = np.clip(np.floor(sx.max(axis=1) - 0.5) + 1, 0, width).astype(np.int64)
+    y0 = np.clip(np.ceil(sy.min(axis=1) - 0.5), 0, height).astype(np.int64)
+    y1 = np.clip(np.floor(sy.max(axis=1) - 0.5) + 1, 0, height).astype(np.int64)
+    areas = (sx[:, 1] - sx[:, 0]) * (sy[:, 2] - sy[:, 0]) - (sx[:, 2] - sx[:, 0]) * (sy[:, 1] - sy[:, 0])
+    box_w = x1 - x0
+    pix_count = np.where((areas != 0) & (x1 > x0) & (y1 > y0), box_w * (y1 - y0), 0)
+    live = np.flatnonzero(pix_count)
+    # do triangles a chunk at a time, so huge triangles don't blow up memory
+    chunk_ends = np.searchsorted(np.cumsum(pix_count[live]), np.arange(1, 1 + pix_count.sum() // 2**22) * 2**22)
+    for chunk in np.split(live, chunk_ends):
+        if len(chunk) == 0:
+            continue
+        tri_n = np.repeat(chunk, pix_count[chunk])
+        k = np.arange(len(tri_n)) - np.repeat(np.cumsum(pix_count[chunk]) - pix_count[chunk], pix_count[chunk])
+        px = x0[tri_n] + k % box_w[tri_n]
+        py = y0[tri_n] + k // box_w[tri_n]
+        cx = px + 0.5
+        cy = py + 0.5
+        tx, ty = sx[tri_n], sy[tri_n]
+        # barycentric weights of pixel center
+        w0 = ((tx[:, 1] - cx) * (ty[:, 2] - cy) - (tx[:, 2] - cx) * (ty[:, 1] - cy)) / areas[tri_n]
+        w1 = ((tx[:, 2] - cx) * (ty[:, 0] - cy) - (tx[:, 0] - cx) * (ty[:, 2] - cy)) / areas[tri_n]
+        w2 = 1 - w0 - w1
+        inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+        tri_n, w0, w1, w2 = tri_n[inside], w0[inside], w1[inside], w2[inside]
+        tri_d = depths[tri_n]
+        # perspective correct depth
+        pix_depth = 1 / (w0 / tri_d[:, 0] + w1 / tri_d[:, 1] + w2 / tri_d[:, 2])
+        pix = py[inside] * width + px[inside]
+        np.minimum.at(depth_min, pix, pix_depth)
+        np.maximum.at(depth_max, pix, pix_depth)
+    return depth_min.reshape(height, width), depth_max.reshape(height, width)
+
+def depth_slope(depth):
+    # biggest depth step to a neighbouring pixel, per pixel (empty neighbours don't count). A surface seen
+    # at a grazing angle changes depth a lot across one pixel, so a lookup within that much of it can't
+    # tell whether a point is in front or behind.
+    height, width = depth.shape
+    padded = np.pad(depth, 1, mode='edge')
+    slope = np.zeros(depth.shape)
+    with np.errstate(invalid='ignore'):
+        for dy, dx in ((0, 1), (2, 1), (1, 0), (1, 2)):
+            step = np.abs(padded[dy:dy + height, dx:dx + width] - depth)
+            slope = np.maximum(slope, np.where(np.isfinite(step), step, 0))
+    return slope
+
+class DepthBuffer:
+    # occluders for the Depth engine. Occluder triangles are rasterized from the camera, keeping nearest
+    # and farthest depth per pixel, so rays toward or straight away from the camera become a lookup.
+    # anything the buffer can't answer (off frame, ortho camera, hit could be out of ray range) is ray cast.
+    def __init__(self, mask, mask_objs=None):
+        vampparams = bpy.context.scene.vamp_params
+        self.mask = mask
+        self.mask_objs = mask_objs
+        self.fallback = None
+        self.view = get_frame_view()
+        mat_inv, frame, ortho = self.view
+        self.ortho = ortho
+        self.width = vampparams.vamp_depth_res
+        self.height = max(1, int(round(self.width * (frame[0, 1] - frame[1, 1]) / (frame[1, 0] - frame[2, 0]))))
+        if ortho:
+            print('depth engine: orthographic camera, using raycasts')
+            return
+        with profile_stage('raster'):
+            self.depth_min, self.depth_max = rasterize_depth(mask.verts[mask.tris], self.view, self.width, self.height)
+            self.slope_min = depth_slope(self.depth_min)
+            self.slope_max = depth_slope(self.depth_max)
+    
+    def occluders(self):
+        # regular BVH / OccluderSet, built the first time something needs a real ray cast
+        if self.fallback is None:
+            self.fallback = get_occluders(self.mask, self.mask_objs)
+        return self.fallback
+    
+    def ray_cast(self, origin, direction, distance):
+        return self.occluders().ray_cast(origin, direction, distance)
+    
+    def cast_rays(self, origins, directions, ray_dists):
+        return cast_rays(self.occluders(), origins, directions, ray_dists)
+    
+    def hits_batch(self, points, targets, origins, directions, ray_dists):
+        # same result as ray_hits_batch, for rays from points to targets (origins etc. as set up there)
+        vampparams = bpy.context.scene.vamp_params
+        hits = np.zeros(len(points), dtype=bool)
+        known = np.zeros(len(points), dtype=bool)
+        if not self.ortho and len(points) > 0:
+            cam_loc = np.array(cam.matrix_world.to_translation())
+            co_ndc = project_points(points, self.view)
+            px = np.floor(co_ndc[:, 0] * self.width)
+            py = np.floor(co_ndc[:, 1] * self.height)
+            on_buffer = (co_ndc[:, 2] > 0.001) & (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+            # only rays straight toward camera, or straight away from it, follow a pixel
+            to_cam = cam_loc - points
+            cam_dists = np.sqrt((to_cam * to_cam).sum(axis=1))
+            along = ((targets - points) * to_cam).sum(axis=1) / np.where(cam_dists > 0, cam_dists, 1)
+            toward = on_buffer & np.isclose(along, np.sqrt(((targets - points) ** 2).sum(axis=1)))
+            away = on_buffer & ~toward & np.isclose(-along, np.sqrt(((targets - points) ** 2).sum(axis=1)))
+            idx = np.flatnonzero(toward | away)
+            count_stat('depth_lookups', len(idx))
+            z = co_ndc[idx, 2]
+            pix = (py[idx].astype(np.int64), px[idx].astype(np.int64))
+            gap = z * (vampparams.vamp_cast_sensitivity + vampparams.vamp_depth_tol)
+            # depth change covered by ray length. (depth is proportional to distance along a pixel's ray)
+            reach = z * ray_dists[idx] / np.where(cam_dists[idx] > 0, cam_dists[idx], 1)
+            is_toward = toward[idx]
+            nearest = np.where(is_toward, self.depth_min[pix], self.depth_max[pix])
+            # toward camera: hidden if nearest surface is in front of point. away: hit if anything is behind
+            offset = np.where(is_toward, z - nearest, nearest - z)
+            # within a pixel's depth slope of the surface, it's too close to call. those are ray cast
+            slope = np.where(is_toward, self.slope_min[pix], self.slope_max[pix])
+            hit = (offset > gap + slope) & (offset <= reach)
+            clear = offset <= gap
+            hits[idx] = hit
+            known[idx] = hit | clear
+            if vampparams.vamp_depth_compare and len(idx) > 0:
+                ray_hits = self.cast_rays(origins[idx], directions[idx], ray_dists[idx])
+                answered = known[idx]
+                differ = int((ray_hits[answered] != hits[idx][answered]).sum())
+                print('depth compare:', differ, 'of', int(answered.sum()), 'points differ from raycast',
+                    '(%.2f%%)' % (100 * differ / max(1, int(answered.sum()))))
+        todo = np.flatnonzero(~known)
+        if len(todo) > 0:
+            hits[todo] = self.cast_rays(origins[todo], directions[todo], ray_dists[todo])
+        return hits
+
 def hit_test_bvh(originV,targetV,the_bvh):
     # hit test. bvh version is reliable
     cast_sens = bpy.context.scene.vamp_params.vamp_cast_sensitivity
@@ -556,38 +1398,654 @@ def hit_test_bvh(originV,targetV,the_bvh):
     ray_dist = min(ray_dist, cam_dist)
     
     (loc,norm,indx,dist) = the_bvh.ray_cast(new_origin,direction,ray_dist)
+    count_stat('rays')
     if loc is not None:
+        count_stat('ray_hits')
         return True # vert will be excluded, because it hit something.
     else:
         #vert might be visible, but still needs to be considered for cropping.
-        scene = bpy.context.scene # sh/b redundant..
-        co_ndc = world_to_camera_view(scene, cam, originV)    
-        # if vert is a candidate, may also need to also check if in cam view
         if bpy.context.scene.vamp_params.vamp_crop_enum == 'None': 
             # camera crop turned off.  return hit check false
             return False
-        elif bpy.context.scene.vamp_params.vamp_crop_enum == 'Front':
-            if (co_ndc[2] < .01):#remove items immediately in front of plane also, due to distortion.
-                return True # vert behind camera plane. Treate like a hit and exclude. 
-            else:
-                return False # vert in front of camera plane, presume visible 
-        else:          
-            #need to also test whether vert is within camera frame
-            # confirm that vertex is visible, within view cone & range of camera
-            if (co_ndc[0] >= 0) and (co_ndc[0] <= 1) and \
-            (co_ndc[1] >= 0) and (co_ndc[1] <= 1) and \
-            (co_ndc[2] > 0):            
-            #(co_ndc[2] > 0) and (co_ndc[2] <= ray_dist): # removed ray dist test, was causing confusion w. Cull behavior.
-                return False # vert within camera view
-            else:
-                return True # vert outside of camera view, treat like a hit and exclude from all views    
+        # vert behind camera plane or outside camera frame is treated like a hit, and excluded from all views
+        return bool(crop_hits_batch(np.array([originV[:]], dtype=np.float32))[0])
+
+def contour_edges(geom):
+    # analytic silhouette: True for edges between a front facing & a back facing face, 
+    # open edges (only 1 face) and loose edges (no faces, e.g. from curves). In edge order of geom (SceneGeometry)
+    if cam.data.type == 'ORTHO':
+        to_cam = np.array(cam.matrix_world.to_3x3().col[2])[None, :]
+    else:
+        to_cam = np.array(cam.matrix_world.to_translation()) - geom.face_centers
+    front = (geom.face_normals * to_cam).sum(axis=1) > 0
+    loop_front = front[geom.loop_face]
+    front_count = np.bincount(geom.loop_edge[loop_front], minlength=len(geom.edges))
+    back_count = np.bincount(geom.loop_edge[~loop_front], minlength=len(geom.edges))
+    return ((front_count > 0) & (back_count > 0)) | (front_count + back_count < 2)
+
+def camera_view():
+    # what world_to_camera_view needs, worked out once: inverse camera matrix, view frame corners, ortho
+    scene = bpy.context.scene
+    mat_inv = np.array(cam.matrix_world.normalized().inverted())
+    frame = np.array([v[:] for v in cam.data.view_frame(scene=scene)[:3]])
+    return mat_inv, frame, cam.data.type == 'ORTHO'
+
+def get_frame_view():
+    # camera_view of the frame main_routine is working on
+    if frame_view is None:
+        return camera_view()
+    return frame_view
+
+def project_points(points, view=None):
+    # vectorized world_to_camera_view. x,y 0-1 across camera frame, z = distance in front of camera
+    if view is None:
+        view = get_frame_view()
+    mat_inv, frame, ortho = view
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    co_local = points @ mat_inv[:3, :3].T + mat_inv[:3, 3]
+    z = -co_local[:, 2]
+    if ortho:
+        scale = np.ones(len(points))
+    else:
+        scale = -z / frame[0, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (co_local[:, 0] - frame[2, 0] * scale) / ((frame[1, 0] - frame[2, 0]) * scale)
+        y = (co_local[:, 1] - frame[1, 1] * scale) / ((frame[0, 1] - frame[1, 1]) * scale)
+    co_ndc = np.stack((x, y, z), axis=1)
+    if not ortho:
+        co_ndc[z == 0] = (0.5, 0.5, 0.0)
+    return co_ndc
+
+def edge_sub_counts(v0, v1, edge_lengths):
+    # how many subedges each edge (v0[i] to v1[i]) gets. 
+    # outputs: counts, offscreen (True where edge is all behind camera or all off one side of frame)
+    vampparams = bpy.context.scene.vamp_params
+    subedge_limit = vampparams.vamp_subd_limit # max # of subd cuts
+    counts = np.clip(np.rint(edge_lengths / vampparams.vamp_edge_subdiv), 1, subedge_limit).astype(np.int32)
+    offscreen = np.zeros(len(counts), dtype=bool)
+    if not vampparams.vamp_subd_screen or len(counts) == 0:
+        return counts, offscreen
+    render = bpy.context.scene.render
+    pct = render.resolution_percentage / 100
+    ndc0 = project_points(v0)
+    ndc1 = project_points(v1)
+    in_front = (ndc0[:, 2] > 0) & (ndc1[:, 2] > 0)
+    offscreen = ((ndc0[:, 2] <= 0) & (ndc1[:, 2] <= 0)) | (in_front & (
+        ((ndc0[:, 0] < 0) & (ndc1[:, 0] < 0)) | ((ndc0[:, 0] > 1) & (ndc1[:, 0] > 1)) | 
+        ((ndc0[:, 1] < 0) & (ndc1[:, 1] < 0)) | ((ndc0[:, 1] > 1) & (ndc1[:, 1] > 1))))
+    pixels = np.hypot((ndc1[:, 0] - ndc0[:, 0]) * render.resolution_x * pct, 
+        (ndc1[:, 1] - ndc0[:, 1]) * render.resolution_y * pct)
+    screen_counts = np.clip(np.rint(pixels / vampparams.vamp_subd_pixels), 1, subedge_limit).astype(np.int32)
+    # edges crossing the camera plane have no sensible screen length, keep their scene length count
+    counts = np.where(in_front, screen_counts, counts)
+    counts[offscreen] = 1
+    return counts, offscreen
+
+def offscreen_cropped(offscreen, v0, v1):
+    # offscreen edges which the crop setting removes entirely, so they never need a raycast
+    crop_mode = bpy.context.scene.vamp_params.vamp_crop_enum
+    if crop_mode == 'None' or not np.any(offscreen):
+        return np.zeros(len(offscreen), dtype=bool)
+    if crop_mode == 'Front':
+        return offscreen & (project_points(v0)[:, 2] < .01) & (project_points(v1)[:, 2] < .01)
+    return offscreen
+
+def subdivide_edges_batch(verts, edges, sub_counts=None):
+    # vectorized version of the edge subdivision in get_slicestuff.
+    # sub_counts (optional) overrides how many subedges each edge gets
+    # outputs: points (all sample points, edge by edge), point_keys (same key = same point),
+    # sub_starts (index of first point of each sub-edge; second point is the next one),
+    # pt_edge (which of edges each point is on), pt_t (how far along that edge, 0-1)
+    v0 = verts[edges[:, 0]]
+    v1 = verts[edges[:, 1]]
+    edge_vects = v1 - v0
+    edge_lengths = np.sqrt((edge_vects * edge_vects).sum(axis=1))
+    edge_sub_count, offscreen = edge_sub_counts(v0, v1, edge_lengths)
+    if sub_counts is not None:
+        edge_sub_count = np.maximum(sub_counts, 1).astype(np.int32)
+    #ignore zero length edges, and edges cropped before they reach the screen
+    keep = (edge_lengths > 0) & ~offscreen_cropped(offscreen, v0, v1)
+    edge_ids = np.flatnonzero(keep)
+    edges, v0, v1 = edges[keep], v0[keep], v1[keep]
+    edge_vects, edge_sub_count = edge_vects[keep], edge_sub_count[keep]
+    # loop version puts in start point, (edge_sub_count-2) midpoints, then end point
+    pt_count = np.maximum(edge_sub_count, 2)
+    first_pt = np.cumsum(pt_count) - pt_count
+    last_pt = first_pt + pt_count - 1
+    pt_edge = np.repeat(np.arange(len(edges)), pt_count)
+    pt_step = (np.arange(len(pt_edge)) - first_pt[pt_edge]).astype(np.float32)
+    edge_sub_offset = edge_vects / edge_sub_count[:, None].astype(np.float32)
+    points = v0[pt_edge] + pt_step[:, None] * edge_sub_offset[pt_edge]
+    points[last_pt] = v1
+    # edge ends are shared with neighbouring edges, so key them by vertex index.
+    # midpoints are unique, key them past the end of the vertex range.
+    point_keys = np.arange(len(points)) + len(verts)
+    point_keys[first_pt] = edges[:, 0]
+    point_keys[last_pt] = edges[:, 1]
+    is_last = np.zeros(len(points), dtype=bool)
+    is_last[last_pt] = True
+    sub_starts = np.flatnonzero(~is_last)
+    pt_t = pt_step / edge_sub_count[pt_edge]
+    pt_t[last_pt] = 1.0
+    return points, point_keys, sub_starts, edge_ids[pt_edge], pt_t
+
+def ray_hits_batch(the_bvh, points, targets):
+    # batch version of the ray cast in hit_test_bvh. 
+    # all origins, directions & distances are set up at once, then fed to the bvh in one pass
+    cast_sens = bpy.context.scene.vamp_params.vamp_cast_sensitivity
+    ray_dist = bpy.context.scene.vamp_params.vamp_raycast_dist
+    direction_vects = targets - points
+    origins = points + direction_vects * cast_sens # raycast with no offset fails (false positives). needs a buffer.
+    cam_dists = np.sqrt((direction_vects * direction_vects).sum(axis=1))
+    directions = direction_vects / np.where(cam_dists > 0, cam_dists, 1)[:, None]
+    # if ray casts PAST camera and hits, need to not count that as a hit!  
+    ray_dists = np.minimum(ray_dist, cam_dists)
+    if isinstance(the_bvh, DepthBuffer):
+        return the_bvh.hits_batch(points, targets, origins, directions, ray_dists)
+    return cast_rays(the_bvh, origins, directions, ray_dists)
+
+def cast_rays(the_bvh, origins, directions, ray_dists):
+    # ray casts already set up by ray_hits_batch, into a BVHTree or OccluderSet. True where ray hits
+    with profile_stage('rays'):
+        if isinstance(the_bvh, OccluderSet):
+            hits = the_bvh.hits_batch(origins, directions, ray_dists)
+        else:
+            ray_cast = the_bvh.ray_cast
+            hits = np.array([ray_cast(o, d, r)[0] is not None for o, d, r in 
+                zip(origins.tolist(), directions.tolist(), ray_dists.tolist())], dtype=bool)
+    count_stat('rays', len(hits))
+    count_stat('ray_hits', int(hits.sum()))
+    return hits
+
+def crop_hits_batch(points):
+    # batch version of the crop test in hit_test_bvh. True where point is cropped (treated like a hit)
+    crop_mode = bpy.context.scene.vamp_params.vamp_crop_enum
+    if crop_mode == 'None' or len(points) == 0:
+        return np.zeros(len(points), dtype=bool)
+    with profile_stage('crop'):
+        co_ndc = project_points(points)
+    if crop_mode == 'Front':
+        return co_ndc[:, 2] < .01
+    else:
+        return ~((co_ndc[:, 0] >= 0) & (co_ndc[:, 0] <= 1) & 
+            (co_ndc[:, 1] >= 0) & (co_ndc[:, 1] <= 1) & (co_ndc[:, 2] > 0))
+
+# incremental mode. Keeps each frame's per-point visibility, and when camera & settings haven't changed,
+# only re-tests points whose rays could pass through objects which moved since the previous frame.
+motion_state = None # previous frame: {'view': view fingerprint, 'objects': {name: (eval serial, bounds)}}
+moved_bounds = [] # world space (min,max) boxes of moved objects, old & new positions
+view_static = False
+vis_history = {} # cache_key -> per-point results of this frame
+vis_history_prev = {} # cache_key -> per-point results of previous frame
+
+def view_fingerprint():
+    # camera & settings. If any of these change, every point needs re-testing
+    scene = bpy.context.scene
+    vampparams = scene.vamp_params
+    cam_data = cam.data
+    fingerprint = [tuple(v for row in cam.matrix_world for v in row)]
+    fingerprint.extend((cam_data.type, cam_data.lens, cam_data.ortho_scale, cam_data.sensor_width, 
+        cam_data.sensor_height, cam_data.sensor_fit, cam_data.shift_x, cam_data.shift_y))
+    fingerprint.extend((scene.render.resolution_x, scene.render.resolution_y, 
+        scene.render.pixel_aspect_x, scene.render.pixel_aspect_y))
+    fingerprint.extend(getattr(vampparams, name) for name in VampProperties.__annotations__)
+    return tuple(fingerprint)
+
+def point_bounds(co):
+    # bounding box (min,max) of points, None if there are none
+    if len(co) == 0:
+        return None
+    return co.min(axis=0), co.max(axis=0)
+
+def begin_incremental_frame():
+    # compare in-range objects & camera against previous frame, find moved objects' bounds
+    global motion_state
+    global moved_bounds
+    global view_static
+    global vis_history
+    global vis_history_prev
+    vis_history_prev = vis_history
+    vis_history = {}
+    if bpy.context.scene.vamp_params.vamp_incremental is False:
+        motion_state = None
+        view_static = False
+        return
+    view_fp = view_fingerprint()
+    objects = {}
+    for obj in inrange_objs + occluder_objs:
+        obj_geometry = object_geometry(obj)
+        state = (eval_cache[obj.name][2], tuple(v for row in obj.matrix_world for v in row))
+        objects[obj.name] = (state, point_bounds(obj_geometry['verts']))
+    view_static = (motion_state is not None) and (motion_state['view'] == view_fp)
+    moved_bounds = []
+    if view_static:
+        for obj_name in set(objects) | set(motion_state['objects']):
+            new = objects.get(obj_name)
+            old = motion_state['objects'].get(obj_name)
+            if new is None or old is None or new[0] != old[0]:
+                # object added, removed, moved or re-evaluated. rays through old & new spots must be re-tested
+                for entry in (new, old):
+                    if entry is not None and entry[1] is not None:
+                        moved_bounds.append(entry[1])
+    motion_state = {'view': view_fp, 'objects': objects}
+    
+def segments_hit_box(starts, ends, box_min, box_max):
+    # vectorized slab test: True where segment start->end passes through box
+    seg_vects = ends - starts
+    flat = seg_vects == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = (box_min - starts) / seg_vects
+        t2 = (box_max - starts) / seg_vects
+    inside = (starts >= box_min) & (starts <= box_max)
+    # segment parallel to slab: either always inside it, or never
+    t_near = np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    t_far = np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+    t_enter = np.maximum(t_near.max(axis=1), 0.0)
+    t_exit = np.minimum(t_far.min(axis=1), 1.0)
+    return t_enter <= t_exit
+
+def rays_cross_moved(points, cam_loc):
+    # True where ray toward camera, or silhouette ray away from camera, could touch a moved object
+    ray_dist = bpy.context.scene.vamp_params.vamp_raycast_dist
+    crossed = np.zeros(len(points), dtype=bool)
+    if len(moved_bounds) == 0 or len(points) == 0:
+        return crossed
+    away_vects = points - cam_loc
+    away_lengths = np.sqrt((away_vects * away_vects).sum(axis=1))
+    away_scale = np.minimum(ray_dist, away_lengths) / np.where(away_lengths > 0, away_lengths, 1)
+    away_ends = points + away_vects * away_scale[:, None]
+    cam_ends = np.broadcast_to(cam_loc, points.shape)
+    for box_min, box_max in moved_bounds:
+        pad = (box_max - box_min) * 0.001 + 0.001 # allow for hit test offset
+        crossed |= segments_hit_box(points, cam_ends, box_min - pad, box_max + pad)
+        crossed |= segments_hit_box(points, away_ends, box_min - pad, box_max + pad)
+    return crossed
+
+def point_keys_bytes(points):
+    # exact byte keys for points, so unchanged points can be matched between frames
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    return points.view(np.dtype((np.void, 12))).reshape(-1)
+
+def reuse_visibility(cache_key, uniq_points, cam_loc):
+    # look up previous frame's results for these points.
+    # outputs: reused (bool), hidden (bool), sil_state (int8, -1 untested, 0 hit, 1 open)
+    hidden = np.zeros(len(uniq_points), dtype=bool)
+    sil_state = np.full(len(uniq_points), -1, dtype=np.int8)
+    reused = np.zeros(len(uniq_points), dtype=bool)
+    if bpy.context.scene.vamp_params.vamp_incremental is False or cache_key is None or not view_static:
+        return reused, hidden, sil_state
+    prev = vis_history_prev.get(cache_key)
+    if prev is None or len(prev['keys']) == 0 or len(uniq_points) == 0:
+        return reused, hidden, sil_state
+    keys = point_keys_bytes(uniq_points)
+    idx = np.minimum(np.searchsorted(prev['keys'], keys), len(prev['keys']) - 1)
+    reused = (prev['keys'][idx] == keys) & ~rays_cross_moved(uniq_points, cam_loc)
+    hidden[reused] = prev['hidden'][idx[reused]]
+    sil_state[reused] = prev['sil_state'][idx[reused]]
+    return reused, hidden, sil_state
+
+def store_visibility(cache_key, uniq_points, hidden, sil_state):
+    if cache_key is None or bpy.context.scene.vamp_params.vamp_incremental is False:
+        return
+    keys = point_keys_bytes(uniq_points)
+    order = np.argsort(keys)
+    vis_history[cache_key] = {'keys': keys[order], 'hidden': hidden[order], 'sil_state': sil_state[order]}
+
+def uniform_visibility(the_bvh, verts, edges, cam_loc, cache_key=None, contour=None, sub_counts=None, sil_test=None):
+    # every edge cut into uniform sub-edges (same as Loop engine), each distinct point tested once.
+    # contour: per edge silhouette flags from contour_edges. If given, no silhouette rays are cast
+    # sub_counts: see subdivide_edges_batch
+    # sil_test: per edge, False where silhouette isn't needed (see edge_roles). None: test all edges
+    # outputs: points, sub_starts (see subdivide_edges_batch), pt_hidden, pt_sil, pt_edge (per point)
+    points, point_keys, sub_starts, pt_edge, pt_t = subdivide_edges_batch(verts, edges, sub_counts)
+    # each distinct point only needs to be tested once
+    uniq_keys, first_idx, inverse = np.unique(point_keys, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    uniq_points = points[first_idx]
+    
+    # incremental mode: reuse previous frame's results where nothing nearby moved
+    reused, hidden, sil_state = reuse_visibility(cache_key, uniq_points, cam_loc)
+    
+    # visibility: cast toward camera, then crop whatever is left
+    todo = np.flatnonzero(~reused)
+    hidden[todo] = ray_hits_batch(the_bvh, uniq_points[todo], cam_loc)
+    candidates = todo[~hidden[todo]]
+    hidden[candidates] = crop_hits_batch(uniq_points[candidates])
+    pt_hidden = hidden[inverse]
+    vis_starts = sub_starts[~pt_hidden[sub_starts] & ~pt_hidden[sub_starts + 1]]
+    
+    if contour is not None:
+        pt_sil = contour[pt_edge]
+    else:
+        # silhouette: if cast AWAY from camera ALSO hits nothing, edge is part of silhouette.
+        # only needed for points on visible sub-edges, which haven't been tested yet
+        sil_starts = vis_starts if sil_test is None else vis_starts[sil_test[pt_edge[vis_starts]]]
+        vis_pts = np.unique(inverse[np.concatenate((sil_starts, sil_starts + 1))])
+        vis_pts = vis_pts[sil_state[vis_pts] < 0]
+        away_pts = uniq_points[vis_pts]
+        sil_state[vis_pts] = ~ray_hits_batch(the_bvh, away_pts, away_pts + (away_pts - cam_loc))
+        pt_sil = sil_state[inverse] == 1
+    store_visibility(cache_key, uniq_points, hidden, sil_state)
+    if cache_key is not None and np.any(reused):
+        print('incremental: reused',int(reused.sum()),'of',len(reused),'points for',cache_key)
+    return points, sub_starts, pt_hidden, pt_sil, pt_edge
+
+def tris_overlap(the_bvh, tris):
+    # True where triangle (shape (n,3,3), world space) touches any occluder.
+    # degenerate triangles can't be tested, so count as touching
+    hit = np.zeros(len(tris), dtype=bool)
+    if len(tris) == 0:
+        return hit
+    if isinstance(the_bvh, DepthBuffer):
+        the_bvh = the_bvh.occluders()
+    areas = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    hit[(areas * areas).sum(axis=1) < 1e-16] = True
+    if isinstance(the_bvh, OccluderSet):
+        tri_min = tris.min(axis=1)
+        tri_max = tris.max(axis=1)
+        for local_bvh, mat, mat_inv, box_min, box_max in the_bvh.entries:
+            cand = np.flatnonzero(~hit & np.all(tri_max >= box_min, axis=1) & np.all(tri_min <= box_max, axis=1))
+            if len(cand) == 0:
+                continue
+            inv = np.array(mat_inv)
+            local_tris = tris[cand].reshape(-1, 3) @ inv[:3, :3].T + inv[:3, 3]
+            tri_bvh = mathutils.bvhtree.BVHTree.FromPolygons(local_tris.tolist(), 
+                np.arange(len(cand) * 3).reshape(-1, 3).tolist(), epsilon = 0.00)
+            for (i, j) in tri_bvh.overlap(local_bvh):
+                hit[cand[i]] = True
+    else:
+        tri_bvh = mathutils.bvhtree.BVHTree.FromPolygons(tris.reshape(-1, 3).tolist(), 
+            np.arange(len(tris) * 3).reshape(-1, 3).tolist(), epsilon = 0.00)
+        for (i, j) in tri_bvh.overlap(the_bvh):
+            hit[i] = True
+    return hit
+
+def adaptive_visibility(the_bvh, verts, edges, cam_loc, contour=None, sil_test=None):
+    # adaptive alternative to uniform_visibility. Edges with nothing between them and the camera
+    # need no rays at all. Other edges are tested at the uniform samples, then bisected down to 
+    # vamp_adaptive_tol wherever visibility changes between neighbouring samples.
+    # contour, sil_test & outputs: same as uniform_visibility
+    vampparams = bpy.context.scene.vamp_params
+    cast_sens = vampparams.vamp_cast_sensitivity
+    ray_dist = vampparams.vamp_raycast_dist
+    adaptive_tol = vampparams.vamp_adaptive_tol
+    points, point_keys, sub_starts, pt_edge, pt_t = subdivide_edges_batch(verts, edges)
+    v0 = verts[edges[:, 0]].astype(np.float64)
+    v1 = verts[edges[:, 1]].astype(np.float64)
+    edge_vects = v1 - v0
+    edge_lengths = np.sqrt((edge_vects * edge_vects).sum(axis=1))
+    
+    # view triangle from each edge to camera. (offset like hit_test_bvh, so edge's own faces don't count)
+    test_edges = np.unique(pt_edge)
+    a = v0[test_edges]
+    b = v1[test_edges]
+    cam_pts = np.broadcast_to(cam_loc.astype(np.float64), a.shape)
+    view_tris = np.stack((a + (cam_pts - a) * cast_sens, b + (cam_pts - b) * cast_sens, cam_pts), axis=1)
+    edge_clear = np.zeros(len(edges), dtype=bool)
+    edge_clear[test_edges] = ~tris_overlap(the_bvh, view_tris)
+    
+    # clear edges can only change visibility by cropping. with no crop, their ends are enough
+    if vampparams.vamp_crop_enum == 'None':
+        keep = ~edge_clear[pt_edge] | (pt_t == 0) | (pt_t == 1)
+        points, point_keys, pt_edge, pt_t = points[keep], point_keys[keep], pt_edge[keep], pt_t[keep]
+    
+    def test_points(pts, e_ids):
+        hidden = np.zeros(len(pts), dtype=bool)
+        todo = np.flatnonzero(~edge_clear[e_ids])
+        hidden[todo] = ray_hits_batch(the_bvh, pts[todo], cam_loc)
+        candidates = np.flatnonzero(~hidden)
+        hidden[candidates] = crop_hits_batch(pts[candidates])
+        return hidden
+    
+    uniq_keys, first_idx, inverse = np.unique(point_keys, return_index=True, return_inverse=True)
+    pt_hidden = test_points(points[first_idx], pt_edge[first_idx])[inverse.reshape(-1)]
+    
+    # bisect between neighbouring samples on the same edge whose visibility differs
+    trans = np.flatnonzero((pt_edge[:-1] == pt_edge[1:]) & (pt_hidden[:-1] != pt_hidden[1:]))
+    t_edge = pt_edge[trans]
+    lo_t = pt_t[trans].astype(np.float64)
+    hi_t = pt_t[trans + 1].astype(np.float64)
+    lo_hidden = pt_hidden[trans]
+    for step in range(24):
+        active = np.flatnonzero((hi_t - lo_t) * edge_lengths[t_edge] > adaptive_tol)
+        if len(active) == 0:
+            break
+        mid_t = (lo_t[active] + hi_t[active]) / 2
+        e_ids = t_edge[active]
+        mid_hidden = test_points((v0[e_ids] + mid_t[:, None] * edge_vects[e_ids]).astype(np.float32), e_ids)
+        to_lo = mid_hidden == lo_hidden[active]
+        lo_t[active[to_lo]] = mid_t[to_lo]
+        hi_t[active[~to_lo]] = mid_t[~to_lo]
+    
+    # add last sample before & first sample after each transition, then put samples back in edge order
+    all_edge = np.concatenate((pt_edge, t_edge, t_edge))
+    all_t = np.concatenate((pt_t.astype(np.float64), lo_t, hi_t))
+    all_hidden = np.concatenate((pt_hidden, lo_hidden, ~lo_hidden))
+    order = np.lexsort((all_t, all_edge))
+    all_edge, all_t, all_hidden = all_edge[order], all_t[order], all_hidden[order]
+    dup = np.zeros(len(all_t), dtype=bool)
+    dup[1:] = (all_edge[1:] == all_edge[:-1]) & (all_t[1:] == all_t[:-1])
+    all_edge, all_t, all_hidden = all_edge[~dup], all_t[~dup], all_hidden[~dup]
+    points = (v0[all_edge] + all_t[:, None] * edge_vects[all_edge]).astype(np.float32)
+    at_start = all_t == 0
+    at_end = all_t == 1
+    points[at_start] = verts[edges[all_edge[at_start], 0]]
+    points[at_end] = verts[edges[all_edge[at_end], 1]]
+    point_keys = np.arange(len(points)) + len(verts)
+    point_keys[at_start] = edges[all_edge[at_start], 0]
+    point_keys[at_end] = edges[all_edge[at_end], 1]
+    sub_starts = np.flatnonzero(all_edge[:-1] == all_edge[1:])
+    vis_starts = sub_starts[~all_hidden[sub_starts] & ~all_hidden[sub_starts + 1]]
+    
+    if contour is not None:
+        return points, sub_starts, all_hidden, contour[all_edge], all_edge
+    
+    # silhouette, only for points on visible sub-edges. 
+    # same as view triangles, edges with a clear quad from edge out to end of rays need no rays
+    def away_end(p):
+        away = p - cam_pts
+        away_len = np.sqrt((away * away).sum(axis=1))
+        return p + away * (np.minimum(ray_dist, away_len) / np.where(away_len > 0, away_len, 1))[:, None]
+    a_off = a + (a - cam_pts) * cast_sens
+    b_off = b + (b - cam_pts) * cast_sens
+    away_hits = tris_overlap(the_bvh, np.concatenate((np.stack((a_off, b_off, away_end(b)), axis=1), 
+        np.stack((a_off, away_end(b), away_end(a)), axis=1))))
+    sil_clear = np.zeros(len(edges), dtype=bool)
+    sil_clear[test_edges] = ~(away_hits[:len(test_edges)] | away_hits[len(test_edges):])
+    pt_sil = np.zeros(len(points), dtype=bool)
+    if sil_test is not None:
+        vis_starts = vis_starts[sil_test[all_edge[vis_starts]]]
+    vis_pts = np.unique(np.concatenate((vis_starts, vis_starts + 1)))
+    pt_sil[vis_pts[sil_clear[all_edge[vis_pts]]]] = True
+    need = vis_pts[~sil_clear[all_edge[vis_pts]]]
+    uniq_keys, first_idx, inverse = np.unique(point_keys[need], return_index=True, return_inverse=True)
+    away_pts = points[need][first_idx]
+    pt_sil[need] = (~ray_hits_batch(the_bvh, away_pts, away_pts + (away_pts - cam_loc)))[inverse.reshape(-1)]
+    return points, sub_starts, all_hidden, pt_sil, all_edge
+
+# deadline mode. Instead of quitting over the edge limit, each frame gets vamp_deadline seconds:
+# all edges are first tested at their ends only, then as many as time allows are fully subdivided,
+# in refine_order. The time is shared out between get_slicestuff calls of the frame.
+deadline_end = None # profile_clock() time visibility must be done by, None when not in deadline mode
+deadline_calls = 0 # get_slicestuff calls still to come this frame
+
+def begin_deadline(slicestuff_calls):
+    global deadline_end
+    global deadline_calls
+    deadline = bpy.context.scene.vamp_params.vamp_deadline
+    deadline_end = None
+    if deadline > 0:
+        # keep back a bit for chaining, output & flattening
+        deadline_end = profile_clock() + deadline * 0.9
+        deadline_calls = slicestuff_calls
+
+def end_deadline():
+    global deadline_end
+    deadline_end = None
+
+def deadline_share():
+    # seconds this get_slicestuff call may spend, or None when not in deadline mode
+    global deadline_calls
+    if deadline_end is None:
+        return None
+    share = (deadline_end - profile_clock()) / max(1, deadline_calls)
+    deadline_calls -= 1
+    return max(0.0, share)
+
+def refine_order(verts, edges, contour):
+    # order to refine edges in: contour edges first, then longest on screen. off-screen edges last
+    v0 = verts[edges[:, 0]]
+    v1 = verts[edges[:, 1]]
+    edge_vects = v1 - v0
+    ndc0 = project_points(v0)
+    ndc1 = project_points(v1)
+    render = bpy.context.scene.render
+    pixels = np.hypot((ndc1[:, 0] - ndc0[:, 0]) * render.resolution_x, (ndc1[:, 1] - ndc0[:, 1]) * render.resolution_y)
+    on_screen = ((ndc0[:, 2] > 0) | (ndc1[:, 2] > 0)) & \
+        ~(((ndc0[:, 0] < 0) & (ndc1[:, 0] < 0)) | ((ndc0[:, 0] > 1) & (ndc1[:, 0] > 1)) |
+        ((ndc0[:, 1] < 0) & (ndc1[:, 1] < 0)) | ((ndc0[:, 1] > 1) & (ndc1[:, 1] > 1)))
+    # edges crossing camera plane have no sensible screen length, use scene length
+    pixels = np.where((ndc0[:, 2] > 0) & (ndc1[:, 2] > 0), pixels, np.sqrt((edge_vects * edge_vects).sum(axis=1)))
+    return np.lexsort((-pixels, ~contour, ~on_screen))
+
+def progressive_visibility(the_bvh, verts, edges, cam_loc, contour, order, stop_time, sil_test=None):
+    # deadline version of uniform_visibility. Coarse pass with edge ends only, then refines edges 
+    # in order (see refine_order) with their full subdivision, a batch at a time until stop_time (profile_clock).
+    # each batch is sized to take about half the time left, going by how fast the last batch ran, 
+    # but at most twice the size of the last one, as the coarse pass is a poor guide (shared end points).
+    # sil_test & outputs: same as uniform_visibility
+    start = profile_clock()
+    coarse = uniform_visibility(the_bvh, verts, edges, cam_loc, None, contour, np.ones(len(edges), dtype=np.int32), 
+        sil_test)
+    spent = profile_clock() - start
+    v0 = verts[edges[:, 0]]
+    v1 = verts[edges[:, 1]]
+    edge_vects = v1 - v0
+    full_counts = edge_sub_counts(v0, v1, np.sqrt((edge_vects * edge_vects).sum(axis=1)))[0]
+    # a refined edge costs about as much per point as the coarse pass did
+    cost = np.maximum(full_counts, 2)
+    order = order[full_counts[order] > 1]
+    per_point = spent / max(1, len(coarse[0]))
+    batches = []
+    done = 0
+    max_batch = 1024 # points
+    while done < len(order):
+        time_left = stop_time - profile_clock()
+        if time_left <= 0:
+            break
+        time_limit = time_left * 0.5 / per_point if per_point > 0 else np.inf
+        affordable = min(time_limit, max_batch)
+        max_batch *= 2
+        take = int(np.searchsorted(np.cumsum(cost[order[done:]]), affordable, side='right'))
+        if take == 0:
+            if affordable < time_limit:
+                continue # next edge alone is bigger than the batch size, try again with a bigger batch
+            break
+        chosen = order[done:done + take]
+        done += take
+        batch_start = profile_clock()
+        fine = uniform_visibility(the_bvh, verts, edges[chosen], cam_loc, None, 
+            None if contour is None else contour[chosen], full_counts[chosen], None if sil_test is None else sil_test[chosen])
+        per_point = (profile_clock() - batch_start) / max(1, len(fine[0]))
+        batches.append((chosen, fine))
+    count_stat('refined_edges', done)
+    count_stat('coarse_edges', len(edges) - done)
+    if len(batches) == 0:
+        return coarse
+    # coarse results of edges which weren't refined, then refined ones, batch by batch
+    points, sub_starts, pt_hidden, pt_sil, pt_edge = coarse
+    refined = np.zeros(len(edges), dtype=bool)
+    refined[order[:done]] = True
+    parts = [(points, sub_starts[~refined[pt_edge[sub_starts]]], pt_hidden, pt_sil, pt_edge)]
+    point_count = len(points)
+    for chosen, fine in batches:
+        parts.append((fine[0], fine[1] + point_count, fine[2], fine[3], chosen[fine[4]]))
+        point_count += len(fine[0])
+    return tuple(np.concatenate([part[n] for part in parts]) for n in range(5))
+
+# what a get_slicestuff pass does with each source edge, as bit flags. One pass can give slice & silhouette 
+# lines of different edges, so each edge source is only tested once per frame.
+ROLE_SLICE = 1 # visible parts go to slice output
+ROLE_SIL = 2 # visible parts which pass the silhouette test go to silhouette output
+ROLE_SIL_LINE = 4 # already silhouette (e.g. from Ind Sil), visible parts go to silhouette output
+
+def edge_roles(edge_count, roles=None):
+    # per edge role flags for get_slicestuff_steps. default: every edge gives slice & silhouette
+    # roles: None, one role for every edge, or an array of roles
+    if roles is None:
+        roles = ROLE_SLICE | ROLE_SIL
+    if np.ndim(roles) == 0:
+        return np.full(edge_count, roles, dtype=np.int8)
+    return np.asarray(roles, dtype=np.int8)
+
+def get_slicestuff_batch_steps(source, mask, cache_key=None, mask_objs=None, roles=None):
+    # batch engine version of get_slicestuff_steps. Same inputs & outputs, 
+    # but edges are subdivided & hit tested as numpy arrays instead of one Vector at a time.
+    global cam
+    cam_loc = np.array(cam.matrix_world.to_translation(), dtype=np.float32)
+    
+    verts, edges = source.verts, source.edges
+    roles = edge_roles(len(edges), roles)
+    sil_test = (roles & ROLE_SIL) != 0
+    contour = None
+    if bpy.context.scene.vamp_params.vamp_sil_contour:
+        contour = contour_edges(source)
+    if bpy.context.scene.vamp_params.vamp_engine_enum == 'Depth':
+        the_bvh = DepthBuffer(mask, mask_objs)
+    else:
+        the_bvh = get_occluders(mask, mask_objs)
+    
+    # deadline mode: this call's share of the time left, now the occluders are built
+    time_left = deadline_share()
+    if time_left is not None:
+        stop_time = profile_clock() + time_left
+        order = refine_order(verts, edges, contour if contour is not None else contour_edges(source))
+    
+    # Background mode tests a chunk of edges at a time, with a progress update in between.
+    # incremental & deadline modes need all edges in one go
+    chunk = max(len(edges), 1)
+    if vamp_job is not None and time_left is None and not bpy.context.scene.vamp_params.vamp_incremental:
+        chunk = job_chunk_edges
+    slice_segs = []
+    sil_segs = []
+    for first in range(0, max(len(edges), 1), chunk):
+        chunk_edges = edges[first:first + chunk]
+        chunk_contour = None if contour is None else contour[first:first + chunk]
+        chunk_roles = roles[first:first + chunk] # deadline mode is always one chunk
+        chunk_sil_test = sil_test[first:first + chunk]
+        if time_left is not None:
+            points, sub_starts, pt_hidden, pt_sil, pt_edge = progressive_visibility(the_bvh, verts, edges, cam_loc, 
+                contour, order, stop_time, sil_test)
+        elif bpy.context.scene.vamp_params.vamp_adaptive:
+            points, sub_starts, pt_hidden, pt_sil, pt_edge = adaptive_visibility(the_bvh, verts, chunk_edges, cam_loc, 
+                chunk_contour, chunk_sil_test)
+        else:
+            points, sub_starts, pt_hidden, pt_sil, pt_edge = uniform_visibility(the_bvh, verts, chunk_edges, cam_loc, 
+                cache_key, chunk_contour, None, chunk_sil_test)
+        count_stat('sub_edges', len(sub_starts))
+        vis_starts = sub_starts[~pt_hidden[sub_starts] & ~pt_hidden[sub_starts + 1]]
+        vis_roles = chunk_roles[pt_edge[vis_starts]]
+        sil_starts = vis_starts[(((vis_roles & ROLE_SIL) != 0) & pt_sil[vis_starts] & pt_sil[vis_starts + 1]) | 
+            ((vis_roles & ROLE_SIL_LINE) != 0)]
+        vis_starts = vis_starts[(vis_roles & ROLE_SLICE) != 0]
+        
+        slice_segs.append(np.stack((points[vis_starts], points[vis_starts + 1]), axis=1))
+        sil_segs.append(np.stack((points[sil_starts], points[sil_starts + 1]), axis=1))
+        yield min(first + chunk, len(edges)) / max(len(edges), 1)
+    return build_slice_output(np.concatenate(slice_segs), np.concatenate(sil_segs))
     
                 
-def get_slicestuff(bm_test, bm_mask):
-    # inputs: bm_test, bm_mask
-    # outputs: bm_slice, bm_sil
+def get_slicestuff_steps(source, mask, cache_key=None, mask_objs=None, roles=None):
+    # inputs: source (SceneGeometry whose edges are tested), mask (SceneGeometry whose triangles hide them).
+    # cache_key names this call, for incremental mode (batch engine only)
+    # mask_objs are the objects mask was built from, for cached BVH mode
+    # roles: per edge ROLE_ flags, which output(s) each edge goes to. None: both (see edge_roles)
+    # steps generator (see run_steps): yields progress 0-1 as edges are done. 
+    # outputs: (verts, edges) of visible lines, (verts, edges) of silhouette lines
     global cam
     global c
+    if bpy.context.scene.vamp_params.vamp_engine_enum in ('Batch', 'Depth') or deadline_end is not None:
+        return (yield from get_slicestuff_batch_steps(source, mask, cache_key, mask_objs, roles))
     edge_sub_unit = bpy.context.scene.vamp_params.vamp_edge_subdiv # min length of subd
     subedge_limit = bpy.context.scene.vamp_params.vamp_subd_limit # max # of subd cuts
 
@@ -595,34 +2053,43 @@ def get_slicestuff(bm_test, bm_mask):
     # per https://blender.stackexchange.com/questions/39677/how-do-you-get-an-objects-position-and-rotation-through-script
     cam_loc = cam.matrix_world.to_translation()
     
-    # grab copy of bm_test for slicing
-    bm_slicestuff = bm_test.copy()    
-    bm_slicestuff.normal_update()
-    bm_slicestuff.faces.ensure_lookup_table()
-    bm_slicestuff.edges.ensure_lookup_table()
-    bm_slicestuff.verts.ensure_lookup_table()  
-
-    bmesh.ops.remove_doubles(bm_slicestuff, verts=bm_slicestuff.verts, dist=0.01)    
-   
-    edge_list = bm_slicestuff.edges
+    # source is welded already (see SceneGeometry.welded), so no remove_doubles needed
+    vert_cos = [Vector(co) for co in source.verts.tolist()]
+    edge_list = source.edges.tolist()
+    role_list = edge_roles(len(edge_list), roles).tolist()
 
     cam_v0 = cam_loc #set as global earlier, includes matrix transform
-    compare_edges = edge_list # make dup list for comparison later
     
     # this is only for bvh version. 
-    the_bvh = mathutils.bvhtree.BVHTree.FromBMesh(bm_mask, epsilon = 0.00)
+    the_bvh = get_occluders(mask, mask_objs)
            
     the_edges=[] # all visible edges
     the_sil_edges=[] # silhouette only
     
+    # contour mode: silhouette from face normals instead of rays
+    contour = None
+    if bpy.context.scene.vamp_params.vamp_sil_contour:
+        contour = contour_edges(source).tolist()
+    
+    # screen space subdivision needs all edges projected at once
+    screen_counts = None
+    if bpy.context.scene.vamp_params.vamp_subd_screen:
+        ends = source.verts[source.edges].astype(np.float64).reshape(-1, 2, 3)
+        ends_dist = np.sqrt(((ends[:, 1] - ends[:, 0]) ** 2).sum(axis=1))
+        screen_counts, offscreen = edge_sub_counts(ends[:, 0], ends[:, 1], ends_dist)
+        screen_skip = offscreen_cropped(offscreen, ends[:, 0], ends[:, 1]).tolist()
+        screen_counts = screen_counts.tolist()
+    
     #iterate through all (test_edge) 
-    for test_edge in edge_list:
+    for edge_n, test_edge in enumerate(edge_list):
+        if edge_n % 100 == 99:
+            yield edge_n / len(edge_list) # let Background mode update progress, or move on
 		# subdivide edges based on edge_sub_unit
 		# create sequence of edges that subdivides this edge n times              
         clean_edg_verts = []
         broken_edg_verts = []
-        test_vert0 = test_edge.verts[0].co
-        test_vert1 = test_edge.verts[1].co 
+        test_vert0 = vert_cos[test_edge[0]]
+        test_vert1 = vert_cos[test_edge[1]] 
         test_edge_length = distance(test_vert0,test_vert1) 
         if test_vert0 == test_vert1:
             #ignore zero length edges. skip.
@@ -635,6 +2102,11 @@ def get_slicestuff(bm_test, bm_mask):
             edge_sub_count = 1
         if edge_sub_count > subedge_limit:
             edge_sub_count = subedge_limit
+        if screen_counts is not None:
+            if screen_skip[edge_n]:
+                # cropped anyway, no need to test
+                continue
+            edge_sub_count = screen_counts[edge_n]
         clean_edg_verts.append(test_vert0) # put in starting point for vertex seq        
         edge_sub_offset = (test_vert1 - test_vert0)/edge_sub_count
         if edge_sub_count > 1:
@@ -642,6 +2114,7 @@ def get_slicestuff(bm_test, bm_mask):
                 new_vert = test_vert0 + (i * edge_sub_offset)
                 clean_edg_verts.append(new_vert)
         clean_edg_verts.append(test_vert1) # put in ending point for vertex seq
+        count_stat('sub_edges', len(clean_edg_verts) - 1)
         
         # generate new edge list from vertices above
         for x in range (0,len(clean_edg_verts)-1):
@@ -655,83 +2128,218 @@ def get_slicestuff(bm_test, bm_mask):
             # uses hit_test_bvh(originV,targetV,the_bvh)
             if hit_test_bvh(start_vert,cam_v0,the_bvh) is False and \
                 hit_test_bvh(end_vert,cam_v0,the_bvh) is False:
-                    the_edges.append(edge_pair)
+                    edge_role = role_list[edge_n]
+                    if edge_role & ROLE_SLICE:
+                        the_edges.append(edge_pair)
+                    if edge_role & ROLE_SIL_LINE:
+                        the_sil_edges.append(edge_pair)
+                    elif not edge_role & ROLE_SIL:
+                        continue
+                    elif contour is not None:
+                        if contour[edge_n]:
+                            the_sil_edges.append(edge_pair)
                     # now test for silhouette:
                     # if cast AWAY from camera ALSO hits nothing, edge is part of silhouette
-                    if hit_test_bvh(start_vert,(start_vert+(start_vert-cam_v0)),the_bvh) is False and \
+                    elif hit_test_bvh(start_vert,(start_vert+(start_vert-cam_v0)),the_bvh) is False and \
                         hit_test_bvh(end_vert,(end_vert+(end_vert-cam_v0)),the_bvh) is False:
                             the_sil_edges.append(edge_pair)                            
     
     # now we've got final vertex pairs for edges, need to make a mesh of it.
+    slice_segs = np.array(the_edges, dtype=np.float32).reshape(-1, 2, 3)
+    sil_segs = np.array(the_sil_edges, dtype=np.float32).reshape(-1, 2, 3)
+    return build_slice_output(slice_segs, sil_segs)
 
-    #first, make a set of unique vertices
-    final_verts=[]
-    for pairs in the_edges:
-        vert1=pairs[0]
-        if vert1 not in final_verts: 
-            final_verts.append(vert1)
-        vert2=pairs[1]
-        if vert2 not in final_verts: 
-            final_verts.append(vert2)
-    
-    #now iterate thru edge pairs the_edges, find vert indices from above
-    final_edges=[]
-    for pairs in the_edges:        
-        vert0=pairs[0]
-        vert_start=final_verts.index(vert0)
-        vert1=pairs[1]
-        vert_end=final_verts.index(vert1)       
-        new_pair=[vert_start,vert_end]
-        final_edges.append(new_pair)
-        
-    #repeating steps for silhouette: unique verts
-    final_sil_verts=[]
-    for pairs in the_sil_edges:
-        vert1=pairs[0]
-        if vert1 not in final_sil_verts: 
-            final_sil_verts.append(vert1)
-        vert2=pairs[1]
-        if vert2 not in final_sil_verts: 
-            final_sil_verts.append(vert2)
-        
-    final_sil_edges=[] #silhouette
-    for pairs in the_sil_edges:        
-        vert0=pairs[0]
-        vert_start=final_sil_verts.index(vert0)
-        vert1=pairs[1]
-        vert_end=final_sil_verts.index(vert1)       
-        new_pair=[vert_start,vert_end]
-        final_sil_edges.append(new_pair)    
-
-    final_faces=[] #empty list, for completeness
-    
-    # create new mesh, will be put into _sliceFinal
-    nu_slice_mesh = bpy.data.meshes.new(name='New Slice')
-    nu_slice_mesh.from_pydata(final_verts,final_edges,final_faces)    
-    bm_slicetemp = bmesh.new()
-    bm_slicetemp.from_mesh(nu_slice_mesh)
-    
-    fixed_bm_slice = rebuild_bmesh(bm_slicetemp)    
-   
-    # create new silhouette mesh, will be put into _silhouetteFinal
-    nu_sil_mesh = bpy.data.meshes.new(name='New Silhouette')
-    nu_sil_mesh.from_pydata(final_sil_verts,final_sil_edges,final_faces)  #too many verts, but they get deduped by rebuild below  
-    bm_sil = bmesh.new()
-    bm_sil.from_mesh(nu_sil_mesh)    
-    fixed_bm_sil = rebuild_bmesh(bm_sil)
-
-    return fixed_bm_slice, fixed_bm_sil  
-
-def make_obj(bm_output,obj_name):
+def build_slice_output(slice_segs, sil_segs):
+    # inputs: visible & silhouette sub-edges, as arrays of vertex pairs, shape (n,2,3)
+    # outputs: (verts, edges) of visible lines, (verts, edges) of silhouette lines
+    with profile_stage('chain'):
+        return chain_segments(slice_segs), chain_segments(sil_segs)
+
+def chain_segments(segments):
+    # weld loose sub-edges, then join them up into polylines. returns verts & edges
+    verts, edges = weld_segments(segments, weld_dist)
+    verts, poly_index, poly_offsets = chain_polylines(verts, edges)
+    return verts, polyline_edges(poly_index, poly_offsets)
+
+def chain_polylines(verts, edges):
+    # links edges into ordered polylines through vertices shared by exactly 
+    # 2 edges, then drops the in-between points of straight runs.
+    # outputs: verts (only those still used), poly_index (vertex indices, polyline after polyline), 
+    # poly_offsets (start of each polyline in poly_index, plus end)
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    if len(edges) == 0:
+        return np.empty((0, 3), dtype=np.float32), np.empty(0, dtype=np.int32), np.zeros(1, dtype=np.int32)
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    edge_ends = edges.reshape(-1)
+    degree = np.bincount(edge_ends, minlength=len(verts))
+    # edges around each vertex, as one flat list + start of each vertex's run
+    vert_edges = (np.argsort(edge_ends, kind='stable') // 2).tolist()
+    vert_start = np.concatenate(([0], np.cumsum(degree))).tolist()
+    edge_list = edges.tolist()
+    degree_list = degree.tolist()
+    used = [False] * len(edge_list)
+    poly_index = []
+    poly_offsets = [0]
+    
+    def walk(v, e):
+        # follow edges from v, through pass-through vertices, until an end, junction, or back to start
+        line = [v]
+        while True:
+            used[e] = True
+            a, b = edge_list[e]
+            w = b if a == v else a
+            line.append(w)
+            if degree_list[w] != 2:
+                break
+            e0 = vert_edges[vert_start[w]]
+            e1 = vert_edges[vert_start[w] + 1]
+            e = e1 if e0 == e else e0
+            if used[e]:
+                break # closed loop
+            v = w
+        poly_index.extend(line)
+        poly_offsets.append(len(poly_index))
+    
+    # open polylines start at ends & junctions
+    for v in np.flatnonzero((degree != 2) & (degree > 0)).tolist():
+        for k in range(vert_start[v], vert_start[v + 1]):
+            if not used[vert_edges[k]]:
+                walk(v, vert_edges[k])
+    # whatever is left is closed loops
+    for e in range(len(edge_list)):
+        if not used[e]:
+            walk(edge_list[e][0], e)
+    
+    poly_index = np.array(poly_index, dtype=np.int64)
+    poly_offsets = np.array(poly_offsets, dtype=np.int64)
+    
+    # drop in-between points of straight runs (bend under radians(.5) degrees, as before), all polylines in one go
+    points = verts[poly_index].astype(np.float64)
+    keep = np.ones(len(points), dtype=bool)
+    interior = np.ones(len(points), dtype=bool)
+    interior[poly_offsets[:-1]] = False
+    interior[poly_offsets[1:] - 1] = False
+    mid = np.flatnonzero(interior)
+    v1 = points[mid] - points[mid - 1]
+    v2 = points[mid + 1] - points[mid]
+    lengths = np.sqrt((v1 * v1).sum(axis=1) * (v2 * v2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angles = np.arccos(np.clip((v1 * v2).sum(axis=1) / lengths, -1.0, 1.0))
+    keep[mid[(lengths == 0) | (angles < radians(radians(.5)))]] = False
+    kept_per_line = np.add.reduceat(keep.astype(np.int64), poly_offsets[:-1])
+    poly_offsets = np.concatenate(([0], np.cumsum(kept_per_line)))
+    poly_index = poly_index[keep]
+    
+    # only keep verts still in use
+    used_verts, poly_index = np.unique(poly_index, return_inverse=True)
+    return verts[used_verts], poly_index.reshape(-1).astype(np.int32), poly_offsets.astype(np.int32)
+
+def polyline_edges(poly_index, poly_offsets):
+    # edges joining each point of each polyline to the next
+    starts = np.arange(len(poly_index) - 1)
+    line_ends = np.zeros(len(poly_index), dtype=bool)
+    line_ends[poly_offsets[1:] - 1] = True
+    starts = starts[~line_ends[:-1]]
+    return np.stack((poly_index[starts], poly_index[starts + 1]), axis=1).astype(np.int32)
+
+def weld_segments(segments, weld_dist=0.00001):
+    # distance weld (see weld_points) of sample points, close points become one vertex.
+    # replaces list dedup + .index() lookups, which were O(n^2)
+    # outputs: verts (float32 (v,3)), edges (int32 (n,2))
+    points = np.asarray(segments, dtype=np.float32).reshape(-1, 3)
+    first_idx, inverse = weld_points(points, weld_dist)
+    return points[first_idx], inverse.reshape(-1, 2)
+
+# neighbouring grid cells to check for weld pairs: own cell, plus one of each opposite pair
+WELD_OFFSETS = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1) if (x, y, z) >= (0, 0, 0)]
+
+def weld_points(points, weld_dist):
+    # distance weld, like remove_doubles: points within weld_dist of each other become one 
+    # (so do chains of such points). Exact copies are merged first, then close pairs are found 
+    # through a weld_dist grid, checking each cell against its neighbours, so cell borders don't matter.
+    # outputs: first_idx (point kept for each group), inverse (group of each point, int32)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+    points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+    exact_keys = points.view(np.dtype((np.void, 12))).reshape(-1)
+    uniq_keys, exact_first, exact_inverse = np.unique(exact_keys, return_index=True, return_inverse=True)
+    uniq_points = points[exact_first].astype(np.float64)
+    
+    # points of each cell, as one flat list (cell_order) + start of each cell's run
+    cells = np.floor(uniq_points / weld_dist).astype(np.int64)
+    cells -= cells.min(axis=0) - 1 # neighbours of every cell stay >= 0
+    dims = [int(d) + 2 for d in cells.max(axis=0)]
+    if dims[0] * dims[1] * dims[2] < 2**62:
+        cell_key = lambda c: (c[:, 0] * dims[1] + c[:, 1]) * dims[2] + c[:, 2]
+    else:
+        # too many cells for one int64 key, compare raw bytes instead (much slower)
+        cell_key = lambda c: np.ascontiguousarray(c).view(np.dtype((np.void, 24))).reshape(-1)
+    cell_list, cell_of, cell_counts = np.unique(cell_key(cells), return_inverse=True, return_counts=True)
+    cell_order = np.argsort(cell_of.reshape(-1), kind='stable')
+    cell_start = np.cumsum(cell_counts) - cell_counts
+    sorted_cells = cells[cell_order] # looked up in cell order, which is much quicker for searchsorted
+    pair_a = []
+    pair_b = []
+    for offset in WELD_OFFSETS:
+        near_keys = cell_key(sorted_cells + np.array(offset, dtype=np.int64))
+        near = np.minimum(np.searchsorted(cell_list, near_keys), len(cell_list) - 1)
+        found = np.flatnonzero(cell_list[near] == near_keys)
+        near = near[found]
+        counts = cell_counts[near]
+        a = np.repeat(cell_order[found], counts)
+        b = cell_order[np.repeat(cell_start[near], counts) + np.arange(len(a)) - np.repeat(np.cumsum(counts) - counts, counts)]
+        if offset == (0, 0, 0):
+            keep = b > a
+            a, b = a[keep], b[keep]
+        diff = uniq_points[a] - uniq_points[b]
+        close = (diff * diff).sum(axis=1) <= weld_dist * weld_dist
+        pair_a.append(a[close])
+        pair_b.append(b[close])
+    a = np.concatenate(pair_a)
+    b = np.concatenate(pair_b)
+    
+    # group connected points: every point ends up labelled with the lowest index in its group
+    labels = np.arange(len(uniq_points))
+    while len(a) > 0:
+        low = np.minimum(labels[a], labels[b])
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        labels = labels[labels]
+        if np.array_equal(labels[a], labels[b]) and np.array_equal(labels[labels], labels):
+            break
+    roots, group_of = np.unique(labels, return_inverse=True)
+    return exact_first[roots], group_of.reshape(-1)[exact_inverse.reshape(-1)].astype(np.int32)
+
+def fill_mesh(mesh, verts, edges):
+    # overwrite mesh geometry in place from flat float32/int32 arrays
+    mesh.clear_geometry()
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set('co', np.ascontiguousarray(verts, dtype=np.float32).reshape(-1))
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set('vertices', np.ascontiguousarray(edges, dtype=np.int32).reshape(-1))
+    mesh.update()
+
+def make_obj(verts, edges, obj_name):
+    # write output arrays directly into existing output object. 
+    # view layer is updated once, at end of main_routine
     obj_output = bpy.data.objects[obj_name]
-    bm_output.to_mesh(obj_output.data)
-    # Update view layer (added 2.8)
-    layer = bpy.context.view_layer
-    layer.update()    
+    fill_mesh(obj_output.data, verts, edges)
+    
     
+def flat_location():
+    # location of _flat objects, based on xy cam scale
+    res_y = bpy.context.scene.render.resolution_y
+    res_x = bpy.context.scene.render.resolution_x
+    cam_x_scale = res_x/500
+    cam_y_scale = res_y/500
+    vamp_scale = bpy.context.scene.vamp_params.vamp_scale
+    return Vector ((-0.5 * cam_x_scale * vamp_scale,-0.5 * cam_y_scale * vamp_scale,0))
     
-def make_flattened(bm_output,flattened_name):
+def make_flattened(verts, edges, flattened_name):
     #remap to flat plane for oscistudio to see
+    #returns flattened verts
     global cam
     global vamp_scale
     
@@ -742,33 +2350,56 @@ def make_flattened(bm_output,flattened_name):
     
     
     vamp_scale = bpy.context.scene.vamp_params.vamp_scale
-    # determine location based on xy cam scale
-    flat_loc = Vector ((-0.5 * cam_x_scale * vamp_scale,-0.5 * cam_y_scale * vamp_scale,0))
     # first, make flatSliced    
     flat_sliced = bpy.data.objects[flattened_name]
-    mat_world = flat_sliced.matrix_world
-    
-    # use bm_output, remap vertices
-    FlatVerts = []    
-    for v in bm_output.verts:
-        co_ndc = world_to_camera_view(scene, cam, v.co)        
-        v.co.x = co_ndc[0] * cam_x_scale * vamp_scale
-        v.co.y = co_ndc[1] * cam_y_scale * vamp_scale
-        v.co.z = 0
-    bm_output.to_mesh(flat_sliced.data)
-    flat_sliced.location = flat_loc 
-    layer = bpy.context.view_layer
-    layer.update()  
-    return {'FINISHED'}
+    
+    # remap vertices
+    co_ndc = project_points(verts)
+    flat_verts = np.zeros((len(verts), 3), dtype=np.float32)
+    flat_verts[:, 0] = co_ndc[:, 0] * cam_x_scale * vamp_scale
+    flat_verts[:, 1] = co_ndc[:, 1] * cam_y_scale * vamp_scale
+    fill_mesh(flat_sliced.data, flat_verts, edges)
+    flat_sliced.location = flat_location()
+    return flat_verts
 
-def main_routine(): 
+def run_steps(steps):
+    # runs a steps generator to the end, returns its result. Steps generators yield their progress 
+    # (0-1) every so often, so Background mode can do a bit at a time (see vamp_job_timer)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+def scaled_steps(steps, low, high):
+    # runs steps generator inside another one, passing its progress on scaled to low-high
+    while True:
+        try:
+            progress = next(steps)
+        except StopIteration as done:
+            return done.value
+        yield low + (high - low) * progress
+
+def call_progress(call_n, call_count, low=0.2, high=0.85):
+    # progress range of the call_n'th of call_count get_slicestuff calls
+    share = (high - low) / max(1, call_count)
+    return low + share * call_n, low + share * (call_n + 1)
+
+def main_routine():
+    cancel_vamp_job() # a Background job would be using the same globals
+    return run_steps(run_in_arena(main_routine_steps()))
+
+def main_routine_steps(): 
     global cam
     global sil_mode
     global marked_mode
     global err_text
     global inrange_objs
+    global last_result
+    global frame_view
     
     scene = bpy.data.scenes[0]
+    last_result = None
     sil_mode = bpy.context.scene.vamp_params.vamp_sil_mode
     # sil_mode decides whether silhouette is overall contour (of all objects combined,) or individual 
     # silhouettes per object.
@@ -777,23 +2408,36 @@ def main_routine():
     # marked_mode decides whether internal face detail is based on ALL visible edges or only FREESTYLE-MARKED visible edges
     
     start_time=time.time()   
+    begin_profile(scene.frame_current)
     print('--- running main routine ---')
     print('-- current frame: ',scene.frame_current)
     if trace_on is True:
-        main_trace_routine()
+        with profile_stage('trace'):
+            main_trace_routine()
+        yield 0.0
     
     # presumes item_check run first, to ensure data is there.
-    clean_up_first()
-    mark_inrange() # mark all objects within cull range, avoids further processing on excluded objects.
+    with profile_stage('cull'):
+        clean_up_first()
+        frame_view = camera_view() # camera doesn't move during a frame, project everything with one set of matrices
+        mark_inrange() # mark all objects within cull range, avoids further processing on excluded objects.
+        prune_eval_cache([obj.name for obj in bpy.data.collections[bpy.context.scene.vamp_params.vamp_target].objects])
+    count_stat('objects', len(inrange_objs))
+    count_stat('occluder_objects', len(occluder_objs))
     if (len(inrange_objs) == 0):
         print('zero objects within cull range. End.')
+        end_profile()
         return
+    yield 0.05
         
         
-    get_all_the_stuff() # puts all objects into a single bm_all. used for masking edges from view
+    with profile_stage('join'):
+        get_all_the_stuff() # puts all objects into a single frame_geometry. used for masking edges from view
+    count_stat('edges', original_edge_count)
+    yield 0.15
     print('original edge count is: ',original_edge_count) 
     edge_limit = bpy.context.scene.vamp_params.vamp_edge_limit
-    if original_edge_count > edge_limit:
+    if original_edge_count > edge_limit and bpy.context.scene.vamp_params.vamp_deadline == 0:
         #too many edges. quit.
         print('###########')
         print('I quit.  Edge limit is',edge_limit)
@@ -801,62 +2445,95 @@ def main_routine():
         print('###########') 
         err_text = 'Sorry, too many edges' 
     else:
-        get_sep_meshes() # gets separate meshes, for further processing
+        begin_incremental_frame() # finds what moved since last frame, for incremental mode
+        yield 0.2
         
-        sil_meshes = []
-        if sil_mode is True:
-            # individual sil mode, need to run thru twice
-            for bm_single in sep_meshes:
-                sil = get_slicestuff(bm_single,bm_single)
-                sil_meshes.append(sil[1])
-            bm_joined = join_bmeshes(sil_meshes)
-            bm_sil = get_slicestuff(bm_joined,bm_all)[0]
-        else:
-            bm_sil = get_slicestuff(bm_all,bm_all)[1]   
-        #bm_sil now contains bmesh with silhouette.
-        
-        #test for marked_mode. if true, use freestyle marked edges only.
-        if marked_mode is True:
-            get_marked_edges()
-            bm_slice = get_slicestuff(bm_marked,bm_all)[0]
-        else:
-            bm_slice = get_slicestuff(bm_all,bm_all)[0]
-
-        #clean up extraneous vertices
-        fixed_bm_slice = rebuild_bmesh(bm_slice)
-        fixed_bm_sil = rebuild_bmesh(bm_sil)
+        mask_objs = inrange_objs + occluder_objs
+        # each distinct edge source is tested once: one pass per object in Ind Sil mode, 
+        # then one pass against everything, which gives both slice & silhouette lines
+        slicestuff_calls = len(inrange_objs) + 1 if sil_mode else 1
+        begin_deadline(slicestuff_calls)
+        with profile_stage('visibility'):
+            slice_source = edge_geometry
+            roles = edge_roles(len(edge_geometry.edges))
+            #test for marked_mode. if true, slice uses freestyle marked edges only.
+            if marked_mode is True:
+                with profile_stage('join'):
+                    marked = get_marked_edges()
+                roles[~marked] = ROLE_SIL
+            if sil_mode is True:
+                # individual sil mode: silhouette of each object against itself first
+                sil_parts = []
+                for obj_n, obj in enumerate(inrange_objs):
+                    obj_geometry = frame_geometry.select(frame_geometry.edge_obj == obj_n, [obj_n])
+                    sil = yield from scaled_steps(get_slicestuff_steps(obj_geometry.welded(),obj_geometry,'sil:'+obj.name,[obj],
+                        edge_roles(len(obj_geometry.edges), ROLE_SIL)), *call_progress(obj_n, slicestuff_calls))
+                    sil_parts.append({'verts': sil[1][0], 'edges': sil[1][1]})
+                with profile_stage('join'):
+                    sil_joined = join_geometry(sil_parts).welded()
+                    # then joined silhouettes ride along with the slice edges, only visibility needed
+                    slice_source = edge_geometry.select((roles & ROLE_SLICE) != 0).add_lines(sil_joined.verts, sil_joined.edges)
+                    roles = np.concatenate((np.full(len(slice_source.edges) - len(sil_joined.edges), ROLE_SLICE, dtype=np.int8), 
+                        np.full(len(sil_joined.edges), ROLE_SIL_LINE, dtype=np.int8)))
+            slice_lines, sil_lines = yield from scaled_steps(get_slicestuff_steps(slice_source,frame_geometry,'all',mask_objs,roles), 
+                *call_progress(slicestuff_calls - 1, slicestuff_calls))
+            #slice_lines & sil_lines now contain verts & edges of visible & silhouette lines.
+        end_deadline() # only visibility runs against the deadline
 
         if bpy.context.scene.vamp_params.vamp_denoise_pass:
-            denoise(fixed_bm_slice)  
-            denoise(fixed_bm_sil)              
-        
-        #output to 3d objects:
-        make_obj(fixed_bm_slice,'_slicedFinal')
-        make_obj(fixed_bm_sil,'_silhouetteFinal')
+            with profile_stage('denoise'):
+                slice_lines = denoise(*slice_lines)  
+                sil_lines = denoise(*sil_lines)              
         
-        # now remap to flat        
-        make_flattened(fixed_bm_slice,'_flatSliced')        
-        make_flattened(fixed_bm_sil,'_flatSilhouette')              
+        #chain into polylines, & clean up extraneous vertices
+        with profile_stage('chain'):
+            slice_verts, slice_poly_index, slice_poly_offsets = chain_polylines(*slice_lines)
+            sil_verts, sil_poly_index, sil_poly_offsets = chain_polylines(*sil_lines)
+            slice_edges = polyline_edges(slice_poly_index, slice_poly_offsets)
+            sil_edges = polyline_edges(sil_poly_index, sil_poly_offsets)
+        count_stat('output_verts', len(slice_verts) + len(sil_verts))
+        count_stat('output_edges', len(slice_edges) + len(sil_edges))
+        yield 0.9
         
-        # Update view layer (added 2.8)
-        layer = bpy.context.view_layer
-        layer.update()
-
-        #free all the bmeshes
-        bm_slice.free()
-        bm_sil.free()
-        fixed_bm_slice.free()
-        fixed_bm_sil.free()
+        #output to 3d objects, as flat arrays:
+        with profile_stage('output'):
+            make_obj(slice_verts, slice_edges, '_slicedFinal')
+            make_obj(sil_verts, sil_edges, '_silhouetteFinal')
         
-        #empty trash
-        empty_trash()
+        # now remap to flat        
+        with profile_stage('flatten'):
+            flat_slice_verts = make_flattened(slice_verts, slice_edges, '_flatSliced')        
+            flat_sil_verts = make_flattened(sil_verts, sil_edges, '_flatSilhouette')              
+        yield 0.95
         
-        #UPDATE THE whole dg
-        # per https://blender.stackexchange.com/a/140802/49532
-        dg = bpy.context.evaluated_depsgraph_get() 
-        dg.update()          
-        bpy.context.view_layer.update()
+        # keep this frame's arrays, for baking & export
+        last_result = {'frame': scene.frame_current,
+            'slice_verts': slice_verts, 'slice_edges': slice_edges, 
+            'sil_verts': sil_verts, 'sil_edges': sil_edges,
+            'flat_slice_verts': flat_slice_verts, 'flat_sil_verts': flat_sil_verts,
+            'slice_lines': (slice_poly_index, slice_poly_offsets), 'sil_lines': (sil_poly_index, sil_poly_offsets)}
+        if bpy.context.scene.vamp_params.vamp_export_enum != 'None':
+            with profile_stage('export'):
+                try:
+                    export_frame(last_result)
+                except OSError as e:
+                    # e.g. export path not writable. Say so once, rather than failing again every frame
+                    print('could not export frame, export turned off:', e)
+                    err_text = 'Export failed, turned off'
+                    bpy.context.scene.vamp_params.vamp_export_enum = 'None'
+
+        with profile_stage('cleanup'):
+            #free temporary datablocks
+            run_arena.release()
+            
+            #UPDATE THE whole dg
+            # per https://blender.stackexchange.com/a/140802/49532
+            dg = bpy.context.evaluated_depsgraph_get() 
+            dg.update()          
+            bpy.context.view_layer.update()
         
+    watchdog_check()
+    end_profile()
     end_time = time.time()
     print('execution took ',end_time - start_time,' seconds.')
     print('original edge count was: ',original_edge_count)  
@@ -896,6 +2573,149 @@ def MidpointVecs(vec1, vec2):
     vec = vec / 2
     return vec
     
+def nearest_neighbour_order(points, limit):
+    # greedy nearest neighbour path through points, starting at points[0], up to limit steps.
+    # uses one KDTree, with used points masked out rather than removed. KDTree is only rebuilt 
+    # (from remaining points) once half of its points are used, so whole ordering is O(n log n)
+    point_count = len(points)
+    used = [False] * point_count
+    used[0] = True
+    order = [0]
+    
+    def build_kd():
+        remaining = [i for i in range(point_count) if not used[i]]
+        kd = mathutils.kdtree.KDTree(len(remaining))
+        for i in remaining:
+            kd.insert(points[i], i)
+        kd.balance()
+        return kd, len(remaining)
+    
+    kd, kd_size = build_kd()
+    kd_used = 0
+    current = points[0]
+    for step in range(min(limit, point_count - 1)):
+        if kd_used * 2 > kd_size:
+            kd, kd_size = build_kd()
+            kd_used = 0
+        nearest = None
+        find_count = 8
+        while nearest is None:
+            for (co, index, dist) in kd.find_n(current, find_count):
+                if not used[index]:
+                    nearest = index
+                    break
+            # all of the closest ones are used already, look further out
+            find_count *= 4
+        used[nearest] = True
+        kd_used += 1
+        order.append(nearest)
+        current = points[nearest]
+    return order
+    
+def path_length(points, order):
+    return sum((points[a] - points[b]).length for a, b in zip(order[:-1], order[1:]))
+
+def optimize_trace_path(points, order, time_budget, neighbour_count=8):
+    # shortens a trace order with 2-opt (reverse a stretch of path) and or-opt (move 1-3 points elsewhere) 
+    # moves, until nothing improves or time_budget (seconds) runs out. Moves are only tried between 
+    # spatial neighbours. First point stays first. 
+    start_time = time.time()
+    point_count = len(order)
+    if point_count < 4 or time_budget <= 0:
+        return list(order)
+    
+    def d(a, b):
+        return (points[a] - points[b]).length
+    
+    # neighbour lists, nearest first
+    kd = mathutils.kdtree.KDTree(point_count)
+    for i in order:
+        kd.insert(points[i], i)
+    kd.balance()
+    neighbours = {i: [idx for (co, idx, dist) in kd.find_n(points[i], neighbour_count + 1) if idx != i] for i in order}
+    
+    order = np.array(order)
+    pos = {}
+    def update_pos(first, last):
+        for k in range(first, last + 1):
+            pos[int(order[k])] = k
+    update_pos(0, point_count - 1)
+    
+    def reverse(first, last):
+        order[first:last + 1] = order[first:last + 1][::-1].copy()
+        update_pos(first, last)
+    
+    def out_of_time():
+        return time.time() - start_time > time_budget
+    
+    improved = True
+    while improved and not out_of_time():
+        improved = False
+        # 2-opt
+        for i in range(point_count - 1):
+            if i % 256 == 0 and out_of_time():
+                break
+            a = int(order[i])
+            b = int(order[i + 1])
+            dab = d(a, b)
+            for c in neighbours[a]:
+                dac = d(a, c)
+                if dac >= dab:
+                    break # neighbours are sorted, no gain from here on
+                j = pos[c]
+                if j > i + 1:
+                    # a..b....c..e  ->  a..c....b..e
+                    if j == point_count - 1:
+                        delta = dac - dab
+                    else:
+                        e = int(order[j + 1])
+                        delta = dac + d(b, e) - dab - d(c, e)
+                    if delta < -1e-9:
+                        reverse(i + 1, j)
+                        improved = True
+                        break
+                elif j < i:
+                    # c..f....a..b  ->  c..a....f..b
+                    f = int(order[j + 1])
+                    delta = dac + d(f, b) - d(c, f) - dab
+                    if delta < -1e-9:
+                        reverse(j + 1, i)
+                        improved = True
+                        break
+        # or-opt
+        for seg_len in (1, 2, 3):
+            i = 1
+            while i < point_count - seg_len:
+                if i % 256 == 0 and out_of_time():
+                    break
+                seg = [int(v) for v in order[i:i + seg_len]]
+                p = int(order[i - 1])
+                nx = int(order[i + seg_len])
+                remove_gain = d(p, seg[0]) + d(seg[-1], nx) - d(p, nx)
+                best = None
+                if remove_gain > 1e-9:
+                    for c in set(neighbours[seg[0]] + neighbours[seg[-1]]):
+                        j = pos[c]
+                        if (i - 1 <= j < i + seg_len) or j == point_count - 1:
+                            continue # inside segment, or would rejoin where it came from
+                        e = int(order[j + 1])
+                        forward = d(c, seg[0]) + d(seg[-1], e) - d(c, e)
+                        backward = d(c, seg[-1]) + d(seg[0], e) - d(c, e)
+                        add_cost = min(forward, backward)
+                        if add_cost < remove_gain - 1e-9 and (best is None or add_cost < best[0]):
+                            best = (add_cost, j, backward < forward)
+                if best is not None:
+                    add_cost, j, flip = best
+                    moved = order[i:i + seg_len][::-1].copy() if flip else order[i:i + seg_len].copy()
+                    rest = np.delete(order, np.s_[i:i + seg_len])
+                    insert_at = (j if j < i else j - seg_len) + 1
+                    order = np.insert(rest, insert_at, moved)
+                    update_pos(min(i, insert_at), max(i + seg_len, insert_at + seg_len) - 1)
+                    improved = True
+                else:
+                    i += 1
+    return [int(v) for v in order]
+    
 def main_trace_routine():
     global bm_sil
     print('=== main_trace_routine() ====')
@@ -904,36 +2724,33 @@ def main_trace_routine():
     trace_mode = bpy.context.scene.vamp_params.vamp_trace_enum
 
     target_name = bpy.context.scene.vamp_params.vamp_target
-    bm_all_trace = bmesh.new()
     mark_inrange()
     global inrange_objs
     if len(inrange_objs) == 0:
         #nothing in range. just quit.
         print('no in-range objects. quitting.')
         return 
-    for obj in inrange_objs:
-        data_copy=get_eval_mesh(obj)  
-        #new_edges += len(data_copy.edges)
-        bm_all_trace.from_mesh(data_copy) # appends transformed data to the bmesh
+    # world space arrays of every object, see object_geometry
+    trace_parts = [object_geometry(obj) for obj in inrange_objs]
+    all_trace_verts = np.concatenate([part['verts'] for part in trace_parts])
     inputVecs = []
     outputVecs = []
 
     #map output mode to procedure. 
     if  trace_mode == 'Verts':
-        rawInputVecs = [vert.co for vert in bm_all_trace.verts]
+        rawInputVecs = all_trace_verts.tolist()
     elif trace_mode == 'Edges':
-    # from https://www.blender.org/forum/viewtopic.php?t=26018
-        rawInputVecs = [Vector((edge3.verts[0].co+edge3.verts[1].co)/2) for edge3 in bm_all_trace.edges]
+        rawInputVecs = np.concatenate([part['verts'][part['edges']].mean(axis=1) for part in trace_parts]).tolist()
     elif trace_mode == 'Faces':
-        rawInputVecs = [face.calc_center_median() for face in bm_all_trace.faces] 
+        rawInputVecs = np.concatenate([part['face_centers'] for part in trace_parts]).tolist()
     ### flatSil mode: will take Silhouette as input, subdivide edges again to provide vertices to trace, then trace edges sequentially    
     elif trace_mode == 'FlatSil':
         if bpy.data.objects.get('_flatSilhouette') is None:
-            rawInputVecs = [vert.co for vert in bm_all_trace.verts]
+            rawInputVecs = all_trace_verts.tolist()
         else:
             flatSil = bpy.data.objects.get('_flatSilhouette')
-            bm_sil_trace = bmesh.new()
-            data_copy=get_eval_mesh(flatSil)
+            bm_sil_trace = run_arena.bmesh()
+            data_copy=run_arena.keep(get_eval_mesh(flatSil))
             bm_sil_trace.from_mesh(data_copy)
             # interpolate verts between end points of edges in silhouette mesh
             rawInputVecs = [Vector(edge3.verts[0].co) for edge3 in bm_sil_trace.edges]
@@ -944,12 +2761,12 @@ def main_trace_routine():
     ### FlatSliced mode: will take Flat Sliced final as input, subdivide edges again to provide vertices to trace, then trace edges sequentially    
     elif trace_mode == 'FlatSliced':
         if bpy.data.objects.get('_flatSliced') is None:
-            rawInputVecs = [vert.co for vert in bm_all_trace.verts]
+            rawInputVecs = all_trace_verts.tolist()
         else:
             #flatSil = bpy.data.objects.get('_flatSilhouette')
             flatSliced = bpy.data.objects.get('_flatSliced')
-            bm_sliced_trace = bmesh.new()
-            data_copy=get_eval_mesh(flatSliced)
+            bm_sliced_trace = run_arena.bmesh()
+            data_copy=run_arena.keep(get_eval_mesh(flatSliced))
             bm_sliced_trace.from_mesh(data_copy)
             # interpolate verts between end points of edges in silhouette mesh
             rawInputVecs = [Vector(edge3.verts[0].co) for edge3 in bm_sliced_trace.edges]
@@ -960,12 +2777,12 @@ def main_trace_routine():
 ### flatSil mode: will take Silhouette as input, subdivide edges again to provide vertices to trace, then trace edges sequentially        
     else: #it's flatSil mode. Just use results of flat silhouette.
         if bpy.data.objects.get('_flatSilhouette') is None:
-            rawInputVecs = [vert.co for vert in bm_all_trace.verts]
+            rawInputVecs = all_trace_verts.tolist()
         else:
             #flatSil = bpy.data.objects.get('_flatSilhouette')
             flatSil = bpy.data.objects.get('_flatSliced')
-            bm_sil_trace = bmesh.new()
-            data_copy=get_eval_mesh(flatSil)
+            bm_sil_trace = run_arena.bmesh()
+            data_copy=run_arena.keep(get_eval_mesh(flatSil))
             bm_sil_trace.from_mesh(data_copy)
             # interpolate verts between end points of edges in silhouette mesh
             rawInputVecs = [Vector(edge3.verts[0].co) for edge3 in bm_sil_trace.edges]
@@ -986,31 +2803,22 @@ def main_trace_routine():
         #nothing in range. just quit.
         print('no faces in origin obj. quitting.')
         return 
-    for vec in rawInputVecs:
-        if vec not in inputVecs:
-            inputVecs.append(vec)
-        #append only unique values
-    startVec = inputVecs[0]
-    inputVecs.remove(startVec)
-    outputVecs.append(startVec)
+    #append only unique values (dict keeps first seen order)
+    inputVecs = [Vector(co) for co in dict.fromkeys(tuple(vec) for vec in rawInputVecs)]
 
     limit = bpy.context.scene.vamp_params.vamp_trace_limit
     trace_curve_type = bpy.context.scene.vamp_params.vamp_trace_curve_enum    
-    scope=min(limit,len(inputVecs))
-
-    for i in range (scope):
-        size = len(inputVecs)
-        sizeOut = len(outputVecs)
-        #testVec=inputVecs[size-1]
-        testVec=outputVecs[sizeOut-1]
-        kd = mathutils.kdtree.KDTree(size)
-        for i, v in enumerate(inputVecs):
-            kd.insert(v, i)
-        kd.balance()
-        nearVec=kd.find_n(testVec,1)
-        
-        inputVecs.remove(nearVec[0][0])
-        outputVecs.append(nearVec[0][0])       
+    
+    # starting from first vec, repeatedly step to nearest unused vec
+    trace_order = nearest_neighbour_order(inputVecs, limit)
+    trace_opt_time = bpy.context.scene.vamp_params.vamp_trace_opt_time
+    if trace_opt_time > 0:
+        # shorten path, so beam spends less time jumping
+        length_before = path_length(inputVecs, trace_order)
+        trace_order = optimize_trace_path(inputVecs, trace_order, trace_opt_time)
+        length_after = path_length(inputVecs, trace_order)
+        print('trace path length',round(length_before,4),'->',round(length_after,4))
+    outputVecs = [inputVecs[i] for i in trace_order]
     
     #create 4-element point/weigh variables from vectors
     points=[]
@@ -1032,16 +2840,325 @@ def main_trace_routine():
     #cu = cu.decimate(ratio=0.5)# decimate only works as .ops. in edit context...
     
     #put new data block into existing curve object
+    old_data = bpy.data.objects['_traceFinal'].data
     bpy.data.objects['_traceFinal'].data = cu 
+    if old_data.users == 0:
+        bpy.data.curves.remove(old_data)
     
     #make mesh version too...
     trace_mesh=get_eval_mesh(bpy.data.objects['_traceFinal'])
     trace_mesh.name = 'traceFinalMesh'
+    old_data = bpy.data.objects['_traceFinalMesh'].data
     bpy.data.objects['_traceFinalMesh'].data = trace_mesh   
+    if old_data.users == 0:
+        bpy.data.meshes.remove(old_data)
     #print('trace_mesh is ',trace_mesh)
     print('======== trace done. ',len(points),' vectors plotted..')         
     return {'FINISHED'}
     
+# line cache: a baked frame range in one binary file. Layout is
+#   header:  magic, version, frame count, index offset
+#   frames:  per frame, raw arrays in LINE_CACHE_ARRAYS order
+#   index:   one LINE_CACHE_INDEX record per frame, at end of file
+# all arrays are float32/int32, so the whole file can be memory mapped and frames read without copying.
+LINE_CACHE_MAGIC = b'VAMPLC01'
+LINE_CACHE_HEADER = np.dtype([('magic','S8'),('version','<u4'),('frame_count','<u4'),('index_offset','<u8')])
+LINE_CACHE_INDEX = np.dtype([('frame','<i4'),('slice_verts','<u4'),('slice_edges','<u4'),
+    ('sil_verts','<u4'),('sil_edges','<u4'),('pad','<u4'),('offset','<u8')])
+# (name, dtype, columns, count field in index)
+LINE_CACHE_ARRAYS = (('slice_verts','<f4',3,'slice_verts'),('slice_edges','<i4',2,'slice_edges'),
+    ('sil_verts','<f4',3,'sil_verts'),('sil_edges','<i4',2,'sil_edges'),
+    ('flat_slice_verts','<f4',3,'slice_verts'),('flat_sil_verts','<f4',3,'sil_verts'))
+
+def empty_result(frame):
+    result = {'frame': frame}
+    for name, dtype, cols, count_field in LINE_CACHE_ARRAYS:
+        result[name] = np.empty((0, cols), dtype=dtype)
+    return result
+
+class LineCacheWriter:
+    # writes frames one at a time, then index on close(). Writes to a temp file, which replaces 
+    # path on close(), so a cache that's open for playback is never truncated under it.
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.file = open(self.temp_path, 'wb')
+        self.index = []
+        self.file.write(np.zeros(1, dtype=LINE_CACHE_HEADER).tobytes()) # placeholder, filled in by close()
+    
+    def add_frame(self, result):
+        record = np.zeros(1, dtype=LINE_CACHE_INDEX)
+        record['frame'] = result['frame']
+        record['offset'] = self.file.tell()
+        for name, dtype, cols, count_field in LINE_CACHE_ARRAYS:
+            data = np.ascontiguousarray(result[name], dtype=dtype).reshape(-1, cols)
+            record[count_field] = len(data)
+            self.file.write(data.tobytes())
+        self.index.append(record)
+    
+    def close(self):
+        header = np.zeros(1, dtype=LINE_CACHE_HEADER)
+        header['magic'] = LINE_CACHE_MAGIC
+        header['version'] = 1
+        header['frame_count'] = len(self.index)
+        header['index_offset'] = self.file.tell()
+        if len(self.index) > 0:
+            self.file.write(np.concatenate(self.index).tobytes())
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+        close_playback_cache() # can't replace a memory mapped file on Windows
+        os.replace(self.temp_path, self.path)
+
+class LineCache:
+    # memory mapped reader for a line cache file
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = self.data[:LINE_CACHE_HEADER.itemsize].view(LINE_CACHE_HEADER)[0]
+        if header['magic'] != LINE_CACHE_MAGIC:
+            raise ValueError('not a VAMP line cache: ' + path)
+        index_start = int(header['index_offset'])
+        index_end = index_start + int(header['frame_count']) * LINE_CACHE_INDEX.itemsize
+        self.index = self.data[index_start:index_end].view(LINE_CACHE_INDEX)
+        self.frames = {int(f): n for n, f in enumerate(self.index['frame'])}
+    
+    def frame(self, frame):
+        # returns arrays for frame (views into the file), or None if frame isn't in cache
+        n = self.frames.get(frame)
+        if n is None:
+            return None
+        record = self.index[n]
+        result = {'frame': frame}
+        offset = int(record['offset'])
+        for name, dtype, cols, count_field in LINE_CACHE_ARRAYS:
+            nbytes = int(record[count_field]) * cols * 4
+            result[name] = self.data[offset:offset + nbytes].view(dtype).reshape(-1, cols)
+            offset += nbytes
+        return result
+
+playback_cache = None # open LineCache, for playback
+
+def get_playback_cache():
+    # (re)open cache file if needed, e.g. after a new bake
+    global playback_cache
+    cache_path = bpy.path.abspath(bpy.context.scene.vamp_params.vamp_cache_path)
+    if not os.path.isfile(cache_path):
+        return None
+    mtime = os.path.getmtime(cache_path)
+    if playback_cache is None or playback_cache[0] != (cache_path, mtime):
+        playback_cache = ((cache_path, mtime), LineCache(cache_path))
+    return playback_cache[1]
+
+def close_playback_cache():
+    # drop playback's memory map, e.g. before the cache file is baked again
+    global playback_cache
+    playback_cache = None
+
+def play_cached_frame(frame):
+    # load a baked frame into the output objects, instead of recomputing it
+    line_cache = get_playback_cache()
+    result = line_cache.frame(frame) if line_cache is not None else None
+    if result is None:
+        print('no cached VAMP data for frame',frame)
+        return False
+    clean_up_first()
+    make_obj(result['slice_verts'], result['slice_edges'], '_slicedFinal')
+    make_obj(result['sil_verts'], result['sil_edges'], '_silhouetteFinal')
+    make_obj(result['flat_slice_verts'], result['slice_edges'], '_flatSliced')
+    make_obj(result['flat_sil_verts'], result['sil_edges'], '_flatSilhouette')
+    bpy.data.objects['_flatSliced'].location = flat_location()
+    bpy.data.objects['_flatSilhouette'].location = flat_location()
+    bpy.context.view_layer.update()
+    return True
+
+def bake_frames(frame_start, frame_end, cache_path):
+    # run VAMP over a frame range, writing every frame into a line cache file
+    global baking
+    scene = bpy.context.scene
+    cache_path = bpy.path.abspath(cache_path)
+    close_playback_cache()
+    writer = LineCacheWriter(cache_path)
+    baking = True
+    try:
+        for frame in range(frame_start, frame_end + 1):
+            scene.frame_set(frame)
+            if item_check():
+                main_routine()
+            if last_result is not None:
+                writer.add_frame(last_result)
+            else:
+                print('nothing to bake for frame',frame)
+                writer.add_frame(empty_result(frame))
+    finally:
+        baking = False
+        writer.close()
+    print('baked frames',frame_start,'to',frame_end,'into',cache_path)
+    return frame_end - frame_start + 1
+
+# streaming export of flattened lines, straight from main_routine's arrays (no mesh datablocks).
+#   Binary: per frame .bin files: SEGMENT_HEADER, then slice & silhouette segments as float32 (n,2,2) x,y pairs.
+#           with Index on, frames are appended to one .vseg stream instead, plus a .vseg.idx file of
+#           SEGMENT_INDEX records, so any frame can be read without scanning.
+#   SVG / OBJ: per frame text files, for interchange.
+SEGMENT_MAGIC = b'VAMPSEG1'
+SEGMENT_HEADER = np.dtype([('magic','S8'),('frame','<i4'),('slice_count','<u4'),('sil_count','<u4'),('pad','<u4')])
+SEGMENT_INDEX = np.dtype([('frame','<i4'),('slice_count','<u4'),('sil_count','<u4'),('pad','<u4'),('offset','<u8')])
+
+def flat_segments(result, which, with_location=True):
+    # flattened segments for 'slice' or 'sil', as float32 (n,2,2) x,y pairs
+    verts = np.asarray(result['flat_' + which + '_verts'], dtype=np.float32)[:, :2]
+    if with_location:
+        verts = verts + np.array(flat_location()[:2], dtype=np.float32)
+    return verts[np.asarray(result[which + '_edges'], dtype=np.int32)]
+
+def export_frame(result):
+    # write one frame's flattened lines in the selected export format
+    vampparams = bpy.context.scene.vamp_params
+    export_mode = vampparams.vamp_export_enum
+    prefix = bpy.path.abspath(vampparams.vamp_export_path)
+    if os.path.dirname(prefix) != '':
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    frame_path = prefix + '%04d' % result['frame']
+    if export_mode == 'Binary':
+        slice_segs = flat_segments(result, 'slice')
+        sil_segs = flat_segments(result, 'sil')
+        header = np.zeros(1, dtype=SEGMENT_HEADER)
+        header['magic'] = SEGMENT_MAGIC
+        header['frame'] = result['frame']
+        header['slice_count'] = len(slice_segs)
+        header['sil_count'] = len(sil_segs)
+        if vampparams.vamp_export_index:
+            stream_path = prefix + '.vseg'
+            with open(stream_path, 'ab') as f:
+                offset = f.tell()
+                f.write(header.tobytes() + slice_segs.tobytes() + sil_segs.tobytes())
+            record = np.zeros(1, dtype=SEGMENT_INDEX)
+            record['frame'] = result['frame']
+            record['slice_count'] = len(slice_segs)
+            record['sil_count'] = len(sil_segs)
+            record['offset'] = offset
+            with open(stream_path + '.idx', 'ab') as f:
+                f.write(record.tobytes())
+        else:
+            with open(frame_path + '.bin', 'wb') as f:
+                f.write(header.tobytes() + slice_segs.tobytes() + sil_segs.tobytes())
+    elif export_mode == 'SVG':
+        # svg y axis points down, so flip
+        res_x = bpy.context.scene.render.resolution_x
+        res_y = bpy.context.scene.render.resolution_y
+        width = res_x / 500 * vampparams.vamp_scale
+        height = res_y / 500 * vampparams.vamp_scale
+        with open(frame_path + '.svg', 'w') as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 %f %f">\n' % (width, height))
+            for which, color in (('slice', '#000000'), ('sil', '#ff0000')):
+                if which + '_lines' in result:
+                    # one M...L...L per polyline
+                    points = np.asarray(result['flat_' + which + '_verts'], dtype=np.float64)[:, :2].copy()
+                    points[:, 1] = height - points[:, 1]
+                    poly_index, poly_offsets = result[which + '_lines']
+                    line_points = points[poly_index].tolist()
+                    offsets = np.asarray(poly_offsets).tolist()
+                    path_d = ' '.join('M' + 'L'.join('%.5f %.5f' % tuple(pt) for pt in line_points[start:end]) 
+                        for start, end in zip(offsets[:-1], offsets[1:]))
+                else:
+                    segs = flat_segments(result, which, with_location=False).astype(np.float64)
+                    segs[:, :, 1] = height - segs[:, :, 1]
+                    path_d = ' '.join('M%.5f %.5fL%.5f %.5f' % tuple(seg) for seg in segs.reshape(-1, 4).tolist())
+                f.write('<path id="%s" fill="none" stroke="%s" stroke-width="0.002" d="%s"/>\n' % (which, color, path_d))
+            f.write('</svg>\n')
+    elif export_mode == 'OBJ':
+        with open(frame_path + '.obj', 'w') as f:
+            vert_offset = 1 # obj indices start at 1
+            for which in ('slice', 'sil'):
+                verts = np.asarray(result['flat_' + which + '_verts'], dtype=np.float32)
+                verts = verts + np.array(flat_location()[:], dtype=np.float32)
+                edges = np.asarray(result[which + '_edges'], dtype=np.int64) + vert_offset
+                f.write('o _flat' + ('Sliced' if which == 'slice' else 'Silhouette') + '\n')
+                np.savetxt(f, verts, fmt='v %.6f %.6f %.6f')
+                np.savetxt(f, edges, fmt='l %d %d')
+                vert_offset += len(verts)
+
+def read_exported_frame(stream_path, frame):
+    # random access read of one frame from an indexed .vseg stream. returns slice & silhouette segments,
+    # or None if frame isn't there. If a frame was exported more than once, the latest one wins.
+    index = np.fromfile(stream_path + '.idx', dtype=SEGMENT_INDEX)
+    matches = np.flatnonzero(index['frame'] == frame)
+    if len(matches) == 0:
+        return None
+    record = index[matches[-1]]
+    data = np.memmap(stream_path, dtype=np.uint8, mode='r')
+    start = int(record['offset']) + SEGMENT_HEADER.itemsize
+    slice_end = start + int(record['slice_count']) * 16
+    sil_end = slice_end + int(record['sil_count']) * 16
+    slice_segs = data[start:slice_end].view('<f4').reshape(-1, 2, 2)
+    sil_segs = data[slice_end:sil_end].view('<f4').reshape(-1, 2, 2)
+    return slice_segs, sil_segs
+
+def split_frames(frame_start, frame_end, workers):
+    # split frame range into contiguous chunks, one per worker. 
+    # contiguous frames let each worker reuse cached meshes between frames
+    frames = np.arange(frame_start, frame_end + 1)
+    chunks = np.array_split(frames, max(1, min(workers, len(frames))))
+    return [(int(chunk[0]), int(chunk[-1])) for chunk in chunks if len(chunk) > 0]
+
+def farm_frames(frame_start, frame_end, cache_path, workers):
+    # bake frame range using several background Blender processes, then merge their 
+    # partial caches into one cache file. Frames are independent, so this scales with cores.
+    # returns per-worker stats
+    blend_path = bpy.data.filepath
+    if blend_path == '':
+        raise RuntimeError('Save the .blend file before using the frame farm')
+    if bpy.data.is_dirty:
+        print('WARNING: unsaved changes are not seen by farm workers')
+    cache_path = bpy.path.abspath(cache_path)
+    bake_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vamp_bake.py')
+    stats = []
+    for n, (start, end) in enumerate(split_frames(frame_start, frame_end, workers)):
+        part_path = cache_path + '.part' + str(n)
+        log_file = open(part_path + '.log', 'w')
+        cmd = [bpy.app.binary_path, '-b', blend_path, '--python', bake_script, 
+            '--', '--start', str(start), '--end', str(end), '--out', part_path]
+        proc = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+        stats.append({'worker': n, 'start': start, 'end': end, 'part_path': part_path, 
+            'proc': proc, 'log_file': log_file, 'start_time': time.time(), 'seconds': None})
+    # wait for workers, noting when each one finishes
+    while any(st['seconds'] is None for st in stats):
+        for st in stats:
+            if st['seconds'] is None and st['proc'].poll() is not None:
+                st['seconds'] = time.time() - st['start_time']
+                st['log_file'].close()
+        time.sleep(0.1)
+    # merge partial caches, in frame order
+    close_playback_cache()
+    writer = LineCacheWriter(cache_path)
+    try:
+        for st in stats:
+            frame_count = st['end'] - st['start'] + 1
+            st['fps'] = frame_count / st['seconds'] if st['seconds'] > 0 else 0
+            if st['proc'].returncode != 0 or not os.path.isfile(st['part_path']):
+                print('worker',st['worker'],'failed, see',st['part_path'] + '.log')
+                st['ok'] = False
+                for frame in range(st['start'], st['end'] + 1):
+                    writer.add_frame(empty_result(frame))
+                continue
+            st['ok'] = True
+            part_cache = LineCache(st['part_path'])
+            for frame in range(st['start'], st['end'] + 1):
+                result = part_cache.frame(frame)
+                writer.add_frame(result if result is not None else empty_result(frame))
+            del part_cache
+            os.remove(st['part_path'])
+            os.remove(st['part_path'] + '.log')
+    finally:
+        writer.close()
+    for st in stats:
+        print('worker',st['worker'],': frames',st['start'],'-',st['end'],'in',round(st['seconds'],2),
+            'seconds (',round(st['fps'],2),'frames/sec )', '' if st['ok'] else 'FAILED')
+        del st['proc'], st['log_file']
+    print('farm baked frames',frame_start,'to',frame_end,'into',cache_path)
+    return stats
+
 class OBJECT_OT_vamp_once(bpy.types.Operator):
     bl_label = "VAMP ONCE"
     bl_idname = "render.vamp_once"
@@ -1050,13 +3167,62 @@ class OBJECT_OT_vamp_once(bpy.types.Operator):
         global cam
         global err_text
         if item_check():
-            main_routine()
+            if context.scene.vamp_params.vamp_background is True:
+                start_vamp_job(context.scene.frame_current)
+            else:
+                main_routine()
         else:
             print('item_check failed. :(  ') 
             err_phrase = 'Item check failed.  ' + err_text
             self.report({'WARNING'}, err_phrase)
         return {'FINISHED'}   
 
+class OBJECT_OT_vamp_cancel(bpy.types.Operator):
+    bl_label = "Cancel VAMP"
+    bl_idname = "render.vamp_cancel"
+    bl_description = "Stop Background VAMP job in progress"       
+    def execute(self, context):
+        cancel_vamp_job()
+        return {'FINISHED'}
+
+class OBJECT_OT_vamp_bake(bpy.types.Operator):
+    bl_label = "Bake Frames"
+    bl_idname = "render.vamp_bake"
+    bl_description = "VAMP every frame in scene frame range, save results to cache file"       
+    def execute(self, context):
+        global err_text
+        scene = context.scene
+        if item_check():
+            bake_frames(scene.frame_start, scene.frame_end, scene.vamp_params.vamp_cache_path)
+        else:
+            print('item_check failed. :(  ') 
+            err_phrase = 'Item check failed.  ' + err_text
+            self.report({'WARNING'}, err_phrase)
+        return {'FINISHED'}   
+
+class OBJECT_OT_vamp_farm(bpy.types.Operator):
+    bl_label = "Farm Bake"
+    bl_idname = "render.vamp_farm"
+    bl_description = "Bake scene frame range using several background Blender processes. Save file first"       
+    def execute(self, context):
+        global err_text
+        scene = context.scene
+        if not item_check():
+            print('item_check failed. :(  ') 
+            self.report({'WARNING'}, 'Item check failed.  ' + err_text)
+            return {'FINISHED'}
+        if bpy.data.filepath == '':
+            self.report({'WARNING'}, 'Save the .blend file before using Farm Bake')
+            return {'FINISHED'}
+        if bpy.data.is_dirty:
+            self.report({'WARNING'}, 'Unsaved changes are not seen by farm workers')
+        stats = farm_frames(scene.frame_start, scene.frame_end, scene.vamp_params.vamp_cache_path,
+            scene.vamp_params.vamp_workers)
+        total_fps = sum(st['fps'] for st in stats)
+        self.report({'INFO'}, 'Farm Bake done, ' + str(len(stats)) + ' workers, ' + 
+            str(round(total_fps, 2)) + ' frames/sec total')
+        return {'FINISHED'}   
+
 class OBJECT_OT_vamp_turn_on(bpy.types.Operator):
     global vamp_on
     bl_label = "Turn on VAMP"
@@ -1129,6 +3295,7 @@ class OBJECT_OT_trace_once(bpy.types.Operator):
         global err_text
         if item_check():
             main_trace_routine()
+            run_arena.release()
         else:
             print('item_check failed. :(  ') 
             err_phrase = 'Item check failed.  ' + err_text
@@ -1181,12 +3348,17 @@ class Vamp_PT_Panel(bpy.types.Panel):
 
         sub.scale_y = 2.0   
         sub.operator("render.vamp_once", text="VAMP ONCE")  
+        if vamp_job is not None:
+            row = layout.row(align=True)
+            row.label(text='VAMP frame %d: %d%%' % (vamp_job['frame'], vamp_job['progress'] * 100))
+            row.operator("render.vamp_cancel", text="Cancel")
       
         layout.separator()
         
         #user options
         row = layout.row(align=True)
         row.prop(vampparams, "vamp_sil_mode")
+        row.prop(vampparams, "vamp_sil_contour")
         row.prop(vampparams, "vamp_crop_enum")
         
         row = layout.row(align=True)        
@@ -1196,15 +3368,34 @@ class Vamp_PT_Panel(bpy.types.Panel):
         
         layout.prop(vampparams, "vamp_target")
         layout.prop(vampparams, "vamp_scale")
-        layout.prop(vampparams, "vamp_edge_limit")
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_edge_limit")
+        row.prop(vampparams, "vamp_deadline")
+        row.prop(vampparams, "vamp_background")
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_engine_enum")
+        row.prop(vampparams, "vamp_eval_cache")
+        row.prop(vampparams, "vamp_incremental")
+        row.prop(vampparams, "vamp_bvh_cache")
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_depth_res")
+        row.prop(vampparams, "vamp_depth_tol")
+        row.prop(vampparams, "vamp_depth_compare")
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_adaptive")
+        row.prop(vampparams, "vamp_adaptive_tol")
         
         row = layout.row(align=True)        
         row.prop(vampparams, "vamp_subd_limit")
         row.prop(vampparams, "vamp_edge_subdiv")       
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_subd_screen")
+        row.prop(vampparams, "vamp_subd_pixels")
         
         row = layout.row(align=True)
         row.prop(vampparams, "vamp_cull")
         row.prop(vampparams, "vamp_cull_dist")   
+        row.prop(vampparams, "vamp_frustum_cull")
         
         row = layout.row(align=True)
         row.prop(vampparams, "vamp_raycast_dist")
@@ -1229,11 +3420,45 @@ class Vamp_PT_Panel(bpy.types.Panel):
 
         row = layout.row(align=True)
         row.prop(vampparams, "vamp_trace_limit")
+        row.prop(vampparams, "vamp_trace_opt_time")
         
         row = layout.row(align=True)        
         row.prop(vampparams, "vamp_trace_enum")
         row.prop(vampparams, "vamp_trace_curve_enum")
         
+        layout.separator()
+        # bake & playback
+        layout.prop(vampparams, "vamp_cache_path")
+        row = layout.row(align=True)
+        row.operator("render.vamp_bake", text="Bake Frames")
+        row.prop(vampparams, "vamp_playback")
+        row = layout.row(align=True)
+        row.operator("render.vamp_farm", text="Farm Bake")
+        row.prop(vampparams, "vamp_workers")
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_export_enum")
+        row.prop(vampparams, "vamp_export_index")
+        layout.prop(vampparams, "vamp_export_path")
+        
+        layout.separator()
+        # last frame's timings & counts
+        row = layout.row(align=True)
+        row.prop(vampparams, "vamp_stats_log")
+        row.prop(vampparams, "vamp_stats_path", text="")
+        if last_stats is not None:
+            box = layout.box()
+            box.label(text='Frame %d: %.3f s' % (last_stats['frame'], last_stats['total']))
+            stages = sorted(last_stats['stages'].items(), key=lambda item: -item[1])
+            for name, seconds in stages:
+                box.label(text='%s: %.3f s' % (name, seconds))
+            for name, n in last_stats['counts'].items():
+                box.label(text='%s: %d' % (name.replace('_', ' '), n))
+            memory = last_stats.get('memory')
+            if memory is not None:
+                box.label(text='datablocks: %d (%+d)' % (memory['datablocks'], memory.get('datablock_growth', 0)))
+                if memory['rss_mb'] is not None:
+                    box.label(text='memory: %.1f MB (%+.1f)' % (memory['rss_mb'], memory.get('rss_growth_mb', 0.0)))
+        
         layout.separator()
         # reload this script, re-register app handler
         layout.operator("render.vamp_reloadme", text="Reload Script")
@@ -1246,23 +3471,97 @@ class ExitOK(Exception):
      
 
 
+# Background mode. Instead of running main_routine during the frame change, the handler queues a job,
+# and a timer works through main_routine_steps job_slice seconds at a time, so the UI keeps responding.
+# a new frame replaces any job still running: during playback, only the newest frame gets done.
+def start_vamp_job(frame):
+    global vamp_job
+    cancel_vamp_job()
+    vamp_job = {'frame': frame, 'steps': run_in_arena(main_routine_steps()), 'progress': 0.0, 'paused_at': None}
+    if not bpy.app.timers.is_registered(vamp_job_timer):
+        bpy.app.timers.register(vamp_job_timer)
+    redraw_panel()
+
+def cancel_vamp_job():
+    # drops job in progress, if any. Its half done frame leaves no output & no stats
+    global vamp_job
+    global frame_stats
+    if vamp_job is None:
+        return
+    vamp_job['steps'].close()
+    vamp_job = None
+    frame_stats = None
+    end_deadline()
+    redraw_panel()
+
+def vamp_job_timer():
+    # runs vamp_job for job_slice seconds. returns seconds until next call, or None to stop the timer
+    global vamp_job
+    global profile_paused
+    global frame_stats
+    if vamp_job is None:
+        return None
+    if bpy.data.scenes[0].frame_current != vamp_job['frame']:
+        # frame changed without a new job (VAMP turned off?), this one is stale
+        cancel_vamp_job()
+        return None
+    if vamp_job['paused_at'] is not None:
+        profile_paused += time.perf_counter() - vamp_job['paused_at']
+    slice_end = time.perf_counter() + job_slice
+    finished = True
+    try:
+        while time.perf_counter() < slice_end:
+            vamp_job['progress'] = next(vamp_job['steps'])
+        finished = False
+    except StopIteration:
+        return None
+    finally:
+        if finished:
+            # done, or stopped by an error (Blender prints it, can't carry on). same clean up either way,
+            # so an error leaves no half done stats or deadline behind for the next frame
+            vamp_job = None
+            frame_stats = None
+            end_deadline()
+            redraw_panel()
+    vamp_job['paused_at'] = time.perf_counter()
+    redraw_panel()
+    return 0.01
+
+def redraw_panel():
+    # panel shows Background job progress
+    wm = bpy.context.window_manager
+    if wm is None:
+        return
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type == Vamp_PT_Panel.bl_space_type:
+                area.tag_redraw()
+
 def vamp_handler(scene):    
     global vamp_on
     global cam #te4sti
     global recent_frame
     scene = bpy.data.scenes[0]
+    if baking is True:
+        return # bake_frames runs main_routine itself
+    if bpy.context.scene.vamp_params.vamp_playback is True:
+        play_cached_frame(scene.frame_current)
+        return
     if vamp_on is True:
         if item_check():
             #double check we haven't already vamp'd this frame..
             if scene.frame_current != recent_frame: 
-                main_routine()
+                if bpy.context.scene.vamp_params.vamp_background is True:
+                    start_vamp_job(scene.frame_current)
+                else:
+                    main_routine()
             else:
                 print('***') #something triggered handler again before frame change. skip processing.
             recent_frame = scene.frame_current
         else:
             print('item_check failed. :(  ')      
 
-classes = (OBJECT_OT_vamp_once,OBJECT_OT_vamp_turn_on,OBJECT_OT_vamp_turn_off,OBJECT_OT_trace_once,OBJECT_OT_trace_turn_on,OBJECT_OT_trace_turn_off,OBJECT_OT_reloadme,VampProperties,Vamp_PT_Panel)          
+classes = (OBJECT_OT_vamp_once,OBJECT_OT_vamp_cancel,OBJECT_OT_vamp_bake,OBJECT_OT_vamp_farm,OBJECT_OT_vamp_turn_on,OBJECT_OT_vamp_turn_off,OBJECT_OT_trace_once,OBJECT_OT_trace_turn_on,OBJECT_OT_trace_turn_off,OBJECT_OT_reloadme,VampProperties,Vamp_PT_Panel)          
 
 def re_reg_handler():
     #polite app handler management, per:
@@ -1284,6 +3583,24 @@ def re_reg_handler():
         del driver_namespace[handler_key]
     bpy.app.handlers.frame_change_pre.append(vamp_handler) 
     driver_namespace[handler_key] = vamp_handler
+    
+    # same again for depsgraph handler, which flags edited objects for the eval cache
+    dg_handler_key = 'VAMP_293_DG_KEY'
+    if dg_handler_key in driver_namespace:
+        if driver_namespace[dg_handler_key] in depsgraph_update_post:
+            depsgraph_update_post.remove(driver_namespace[dg_handler_key])
+        del driver_namespace[dg_handler_key]
+    depsgraph_update_post.append(vamp_depsgraph_handler)
+    driver_namespace[dg_handler_key] = vamp_depsgraph_handler
+    
+    # and load handler, which clears caches when another file is opened
+    load_handler_key = 'VAMP_293_LOAD_KEY'
+    if load_handler_key in driver_namespace:
+        if driver_namespace[load_handler_key] in load_post:
+            load_post.remove(driver_namespace[load_handler_key])
+        del driver_namespace[load_handler_key]
+    load_post.append(vamp_load_handler)
+    driver_namespace[load_handler_key] = vamp_load_handler
 
 def register():
     re_reg_handler()
@@ -1293,6 +3610,9 @@ def register():
     bpy.types.Scene.vamp_params = PointerProperty(type=VampProperties)  #old 2.79 version 
  
 def unregister():
+    cancel_vamp_job()
+    if bpy.app.timers.is_registered(vamp_job_timer):
+        bpy.app.timers.unregister(vamp_job_timer)
     for cls in reversed(classes):
         # bpy.utils.unregister_class(cls)  
         # polite deregister, per https://blenderartists.org/t/find-out-if-a-class-is-registered/602335
@@ -1303,4 +3623,4 @@ def unregister():
            
 
 if __name__ == "__main__":
-   register()
\ No newline at end of file
+   register()
@@ -0,0 +1,52 @@
+# VAMP headless bake. Runs VAMP over a frame range in background Blender,
+# and saves every frame into a line cache file (see LineCacheWriter in __init__.py).
+# usage:
+#   blender -b scene.blend --python vamp_bake.py -- [--start N] [--end N] [--out cache.vlc] [--workers N]
+# frame range defaults to the scene frame range, output defaults to the VAMP Cache File setting.
+# with --workers > 1, this process only splits up the range & merges results (see farm_frames).
+
+import sys, os
+import argparse
+import importlib.util
+import bpy
+
+def load_vamp():
+    # use installed add-on if it is enabled, otherwise load VAMP from next to this script
+    vamp = sys.modules.get('vamp_293')
+    if vamp is not None and hasattr(bpy.types.Scene, 'vamp_params'):
+        return vamp
+    init_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__init__.py')
+    spec = importlib.util.spec_from_file_location('vamp_293', init_path)
+    vamp = importlib.util.module_from_spec(spec)
+    sys.modules['vamp_293'] = vamp
+    spec.loader.exec_module(vamp)
+    vamp.register()
+    return vamp
+
+def get_args(scene):
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='vamp_bake.py')
+    parser.add_argument('--start', type=int, default=scene.frame_start, help='first frame')
+    parser.add_argument('--end', type=int, default=scene.frame_end, help='last frame')
+    parser.add_argument('--out', default=None, help='cache file to write')
+    parser.add_argument('--workers', type=int, default=1, help='background Blender processes to use')
+    return parser.parse_args(argv)
+
+def main():
+    vamp = load_vamp()
+    scene = bpy.context.scene
+    args = get_args(scene)
+    if args.out is not None:
+        scene.vamp_params.vamp_cache_path = args.out
+    if not vamp.item_check():
+        print('item_check failed. :(  ', vamp.err_text)
+        sys.exit(1)
+    if args.workers > 1:
+        stats = vamp.farm_frames(args.start, args.end, scene.vamp_params.vamp_cache_path, args.workers)
+        if not all(st['ok'] for st in stats):
+            sys.exit(1)
+    else:
+        vamp.bake_frames(args.start, args.end, scene.vamp_params.vamp_cache_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# VAMP benchmark suite. Builds synthetic scenes in background Blender, runs VAMP on each one
+# with a range of settings, and writes per-stage timings, memory & output size to a JSON file.
+# usage:
+#   blender -b --factory-startup --python vamp_bench.py -- [--out results.json] [--size N] [--repeat N]
+#       [--scenes cubes,spheres,...] [--settings default,ind_sil,...] [--engines Loop,Batch,Depth]
+#       [--compare old_results.json]
+# no GPU or display needed. Use --compare with a results file from another VAMP version to see the difference.
+
+import sys, os
+import argparse
+import json
+import math
+import platform
+import statistics
+import time
+import bpy
+import bmesh
+import numpy as np
+from mathutils import Vector
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from vamp_bake import load_vamp
+
+# settings to run each scene with. keys are vamp_params names
+SETTINGS = {
+    'default': {},
+    'ind_sil': {'vamp_sil_mode': True},
+    'freestyle_crease': {'vamp_marked_mode': True, 'vamp_crease_mode': True},
+    'crop_front': {'vamp_crop_enum': 'Front'},
+    'crop_frame': {'vamp_crop_enum': 'Frame'},
+}
+# same for every case, so the benchmark isn't cut short
+BASE_SETTINGS = {'vamp_edge_limit': 10**9, 'vamp_raycast_dist': 500}
+TRACE_MODES = ['Verts', 'Edges', 'FlatSliced']
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        if not obj.name.startswith('_'): # keep VAMP output objects
+            bpy.data.objects.remove(obj, do_unlink=True)
+    for blocks in (bpy.data.meshes, bpy.data.curves, bpy.data.grease_pencils, bpy.data.cameras):
+        for block in list(blocks):
+            if block.users == 0:
+                blocks.remove(block)
+
+def target_collection(scene):
+    coll = bpy.data.collections.get(scene.vamp_params.vamp_target)
+    if coll is None:
+        coll = bpy.data.collections.new(scene.vamp_params.vamp_target)
+        scene.collection.children.link(coll)
+    return coll
+
+def add_bmesh_object(coll, name, bm, location=(0, 0, 0)):
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    obj = bpy.data.objects.new(name, mesh)
+    obj.location = location
+    coll.objects.link(obj)
+    return obj
+
+def add_camera(scene, location, target=(0, 0, 0)):
+    cam_obj = bpy.data.objects.new('bench_cam', bpy.data.cameras.new('bench_cam'))
+    scene.collection.objects.link(cam_obj)
+    cam_obj.location = location
+    direction = Vector(target) - Vector(location)
+    cam_obj.rotation_euler = direction.to_track_quat('-Z', 'Y').to_euler()
+    scene.camera = cam_obj
+
+def build_cubes(scene, coll, size):
+    # grid of cubes, lots of small objects
+    n = 4 * size
+    for i in range(n):
+        for j in range(n):
+            bm = bmesh.new()
+            bmesh.ops.create_cube(bm, size=1.0)
+            add_bmesh_object(coll, 'cube_%d_%d' % (i, j), bm, ((i - n / 2) * 3, (j - n / 2) * 3, 0))
+    add_camera(scene, (n * 2, -n * 2.5, n * 2))
+
+def build_spheres(scene, coll, size):
+    # few high poly objects, lots of edges & self occlusion
+    for i in range(3):
+        bm = bmesh.new()
+        bmesh.ops.create_uvsphere(bm, u_segments=32 * size, v_segments=16 * size, radius=2.0)
+        add_bmesh_object(coll, 'sphere_%d' % i, bm, ((i - 1) * 3, i * 2, 0))
+    add_camera(scene, (0, -14, 4))
+
+def build_curves(scene, coll, size):
+    # helix curves, edges with no faces
+    for i in range(10 * size):
+        crv = bpy.data.curves.new('helix_%d' % i, 'CURVE')
+        crv.dimensions = '3D'
+        spline = crv.splines.new('POLY')
+        spline.points.add(199)
+        t = np.linspace(0, 8 * math.pi, 200)
+        co = np.stack((np.cos(t) + (i % 5) * 3 - 6, np.sin(t) + (i // 5) * 3, t / 4, np.ones(200)), axis=1)
+        spline.points.foreach_set('co', co.ravel())
+        obj = bpy.data.objects.new('helix_%d' % i, crv)
+        coll.objects.link(obj)
+    add_camera(scene, (0, -25, 12), (0, 3 * size, 3))
+
+def build_gp_strokes(scene, coll, size):
+    # baked grease pencil strokes (legacy grease pencil API, as used by VAMP)
+    gp = bpy.data.grease_pencils.new('bench_gp')
+    layer = gp.layers.new('strokes', set_active=True)
+    frame = layer.frames.new(scene.frame_current)
+    rng = np.random.default_rng(0)
+    for i in range(50 * size):
+        stroke = frame.strokes.new()
+        stroke.points.add(50)
+        co = np.cumsum(rng.normal(scale=0.1, size=(50, 3)), axis=0) + rng.uniform(-5, 5, 3)
+        stroke.points.foreach_set('co', co.astype(np.float32).ravel())
+    obj = bpy.data.objects.new('bench_gp', gp)
+    coll.objects.link(obj)
+    add_camera(scene, (0, -20, 5))
+
+def build_occluder_stack(scene, coll, size):
+    # dense grids stacked in front of each other, so most edges are hidden
+    for i in range(8):
+        bm = bmesh.new()
+        bmesh.ops.create_grid(bm, x_segments=20 * size, y_segments=20 * size, size=4.0 - i * 0.3)
+        obj = add_bmesh_object(coll, 'layer_%d' % i, bm, (i * 0.2, i * 1.5, 0))
+        obj.rotation_euler = (math.pi / 2, 0, i * 0.1)
+    add_camera(scene, (0, -15, 1))
+
+SCENES = {
+    'cubes': build_cubes,
+    'spheres': build_spheres,
+    'curves': build_curves,
+    'gp_strokes': build_gp_strokes,
+    'occluder_stack': build_occluder_stack,
+}
+
+def rss_mb():
+    # current resident memory of this process, MB. None where not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb():
+    # highest resident memory of this process so far, MB. this is a high-water mark for the whole run,
+    # so a case only shows up in it if it goes above every case before it
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def apply_settings(params, defaults, overrides):
+    for name, value in defaults.items():
+        setattr(params, name, value)
+    for name, value in overrides.items():
+        setattr(params, name, value)
+
+def trace_points():
+    obj = bpy.data.objects.get('_traceFinal')
+    if obj is None:
+        return 0
+    return sum(len(s.points) + len(s.bezier_points) for s in obj.data.splines)
+
+def run_case(vamp, scene, mode, repeat):
+    # runs VAMP repeat times from a cold cache. returns timings, memory & output size
+    vamp.prune_eval_cache([])
+    vamp.motion_state = None
+    runs = []
+    rss_before = rss_mb()
+    peak_before = peak_rss_mb()
+    for n in range(repeat):
+        if not vamp.item_check():
+            return {'error': vamp.err_text}
+        wall = time.perf_counter()
+        if mode == 'trace':
+            vamp.begin_profile(scene.frame_current)
+            with vamp.profile_stage('trace'):
+                vamp.main_trace_routine()
+            vamp.run_arena.release() # free trace temporaries, same as the trace operator
+            vamp.end_profile()
+        else:
+            vamp.main_routine()
+        wall = time.perf_counter() - wall
+        stats = vamp.last_stats or {'stages': {}, 'counts': {}}
+        runs.append({'wall': wall, 'stages': stats['stages'], 'counts': stats['counts']})
+    peak_after = peak_rss_mb()
+    result = {
+        'wall': [run['wall'] for run in runs],
+        'wall_median': statistics.median(run['wall'] for run in runs),
+        'stages_median': {name: statistics.median(run['stages'].get(name, 0.0) for run in runs)
+            for name in set().union(*(run['stages'] for run in runs))},
+        'counts': runs[-1]['counts'],
+        'rss_before_mb': rss_before, 'rss_after_mb': rss_mb(),
+        # how far this case raised the process peak. 0 means it stayed under the peak of earlier cases,
+        # not that it used no memory
+        'peak_rss_growth_mb': None if peak_before is None else peak_after - peak_before,
+    }
+    if mode == 'trace':
+        result['output'] = {'trace_points': trace_points()}
+    elif vamp.last_result is not None:
+        result['output'] = {name: int(len(vamp.last_result[name])) for name in
+            ('slice_verts', 'slice_edges', 'sil_verts', 'sil_edges')}
+    return result
+
+def get_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='vamp_bench.py')
+    parser.add_argument('--out', default='vamp_bench.json', help='results file to write')
+    parser.add_argument('--size', type=int, default=1, help='scene size multiplier')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (first one is from a cold cache)')
+    parser.add_argument('--scenes', default=','.join(SCENES), help='comma separated scenes to run')
+    parser.add_argument('--settings', default=','.join(SETTINGS), help='comma separated settings to run')
+    parser.add_argument('--engines', default='Loop,Batch,Depth', help='comma separated engines to run')
+    parser.add_argument('--no-trace', action='store_true', help='skip trace cases')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare against')
+    return parser.parse_args(argv)
+
+def compare(results, old_path):
+    # print wall time ratio of every case found in both result files
+    with open(old_path) as f:
+        old = {case['id']: case for case in json.load(f)['cases']}
+    print('%-50s %10s %10s %8s' % ('case', 'old (s)', 'new (s)', 'ratio'))
+    for case in results['cases']:
+        before = old.get(case['id'])
+        if before is None or 'wall_median' not in before or 'wall_median' not in case:
+            continue
+        print('%-50s %10.3f %10.3f %8.2f' % (case['id'], before['wall_median'], case['wall_median'],
+            case['wall_median'] / max(before['wall_median'], 1e-9)))
+
+def main():
+    vamp = load_vamp()
+    args = get_args()
+    scene = bpy.data.scenes[0]
+    params = scene.vamp_params
+    scene.frame_set(1)
+    apply_settings(params, {}, BASE_SETTINGS)
+    changed = set().union(*SETTINGS.values()) | {'vamp_engine_enum', 'vamp_trace_enum'}
+    defaults = {name: getattr(params, name) for name in changed}
+    results = {'meta': {
+        'vamp_version': list(vamp.bl_info['version']), 'blender': bpy.app.version_string,
+        'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'time': time.time(), 'size': args.size, 'repeat': args.repeat},
+        'cases': []}
+    clear_scene()
+    for scene_name in args.scenes.split(','):
+        clear_scene()
+        coll = target_collection(scene)
+        try:
+            SCENES[scene_name](scene, coll, args.size)
+        except (AttributeError, TypeError, RuntimeError) as e:
+            # e.g. grease pencil API not available in this Blender version
+            print('skipping scene', scene_name, ':', e)
+            results['cases'].append({'id': scene_name, 'scene': scene_name, 'skipped': str(e)})
+            continue
+        bpy.context.view_layer.update()
+        cases = [(engine, setting, 'vamp', {'vamp_engine_enum': engine, **SETTINGS[setting]})
+            for engine in args.engines.split(',') for setting in args.settings.split(',')]
+        if not args.no_trace:
+            cases += [('Batch', trace_mode, 'trace', {'vamp_trace_enum': trace_mode}) for trace_mode in TRACE_MODES]
+        for engine, setting, mode, overrides in cases:
+            case_id = '/'.join((scene_name, mode, engine, setting))
+            print('=== bench case', case_id)
+            apply_settings(params, defaults, overrides)
+            result = run_case(vamp, scene, mode, args.repeat)
+            result.update({'id': case_id, 'scene': scene_name, 'mode': mode, 'engine': engine, 'setting': setting})
+            results['cases'].append(result)
+            print('=== bench case', case_id, 'median', result.get('wall_median'),
+                'peak rss growth (MB, over earlier cases)', result.get('peak_rss_growth_mb'))
+    apply_settings(params, defaults, {})
+    with open(bpy.path.abspath(args.out), 'w') as f:
+        json.dump(results, f, indent=1)
+    print('wrote', args.out)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()